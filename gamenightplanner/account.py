@@ -17,11 +17,14 @@
 
 from invitations.adapters import BaseInvitationsAdapter
 from django.contrib.auth.models import User
+from django.core import signing
+from django.db.models.functions import Lower
 from django.dispatch import Signal
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from social_core.exceptions import AuthForbidden, AuthAlreadyAssociated
 from social_core.pipeline.partial import partial
+from .models import feeds
 
 user_signed_up = Signal(providing_args=["request", "user"])
 
@@ -31,49 +34,70 @@ class InvitationAdapter(BaseInvitationsAdapter):
         return user_signed_up
 
 
-def is_signup(strategy, request, user=None, **kwargs):
-    # FIXME: Is there a better way to detect this?
-    signup = strategy.session_get('account_verified_email', False)
-    if signup:
-        return {'is_signup': True}
-    return {'is_signup': False}
+def get_user_by_email(email):
+    """Returns user with given email regardless of case or None
 
-
-def check_verified_email(strategy, is_signup, backend, **kwargs):
-    if is_signup:
-        account_verified_email = strategy.session_get('account_verified_email',
-                                                      None)
-        if account_verified_email is None:
-            msg = _("Can not sign up without verified email")
-            raise AuthForbidden(backend, msg)
-        else:
-            return {'account_verified_email': account_verified_email}
+    The lookup matches the unique index on lowercased emails created in
+    migration 0010. The index is partial and databases use it only if the
+    query repeats its condition as is, which exclude() does not do.
+    """
+    return User.objects.annotate(email_lower=Lower('email')).filter(
+            email_lower=email.lower()).extra(where=["email <> ''"]).first()
 
 
 @partial
-def signup(backend, strategy, is_signup=False, is_new=False, **kwargs):
-    if is_signup:  # Signup
-        if is_new:
-            try:  # Check if already signed up or not
-                user = User.objects.get(
-                        email=kwargs.get('account_verified_email'))
-            except User.DoesNotExist:
-                return strategy.redirect(reverse(
-                    'account:signup-form',
-                    args=(kwargs.get('current_partial').token,)))
-            else:
-                strategy.session_pop('account_verified_email', None)
-                return {'user': user}
-        else:  # User existed
-            msg = _("This {} account is already registered.".format(
-                    backend.name))
-            raise AuthAlreadyAssociated(backend, msg)
-    else:  # Login
+def signup(backend, strategy, is_new=False, current_partial=None, **kwargs):
+    """Signs up users with a verified email and lets existing users log in
+
+    Signups are told apart from logins by the verified email that accepting
+    an invitation stores in the session. Logins do not query anything and
+    signups look up the user by email once.
+    """
+    email = strategy.session_get('account_verified_email', None)
+    if email is None:  # Login
         if is_new:  # User does not exist
             raise AuthForbidden(backend)
-        else:  # All is good, continue
-            return None
+        return None
+    if not is_new:  # User existed
+        msg = _("This {} account is already registered.".format(
+                backend.name))
+        raise AuthAlreadyAssociated(backend, msg)
+    user = get_user_by_email(email)  # Check if already signed up or not
+    if user is None:
+        return strategy.redirect(reverse('account:signup-form',
+                                         args=(current_partial.token,)))
+    strategy.session_pop('account_verified_email')
+    return {'user': user}
 
 
 def send_user_signed_up(request, user):
     user_signed_up.send(user.__class__, request=request, user=user)
+
+
+FEED_TOKEN_SALT = 'gamenightplanner.account.feed'
+
+
+def get_feed_token(user):
+    """Returns token that identifies user in calendar feed urls
+
+    The token contains the feed key of the user, which is created on first
+    use.
+    """
+    key = feeds.FeedKey.objects.get_or_create(user=user)[0].key
+    return signing.dumps([user.pk, key], salt=FEED_TOKEN_SALT)
+
+
+def get_feed_user(token):
+    """Returns active user identified by feed token or None"""
+    try:
+        pk, key = signing.loads(token, salt=FEED_TOKEN_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    return User.objects.filter(pk=pk, is_active=True,
+                               feed_key__key=key).first()
+
+
+def reset_feed_key(user):
+    """Revokes feed urls of user by giving them a new feed key"""
+    feeds.FeedKey.objects.update_or_create(user=user, defaults={
+            'key': feeds.new_key()})
@@ -16,7 +16,7 @@
 # <http://www.gnu.org/licenses/>.
 
 from django.contrib import admin
-from .models import events
+from .models import availability, events
 
 
 class GameInline(admin.TabularInline):
@@ -26,3 +26,24 @@ class GameInline(admin.TabularInline):
 @admin.register(events.Event)
 class EventAdmin(admin.ModelAdmin):
     inlines = [GameInline]
+    list_display = ('__str__', 'date', 'host', 'participant_count',
+                    'game_count')
+    list_filter = ('participant_count', 'game_count')
+    # Users are searched from their own list instead of listing all of them
+    raw_id_fields = ('host', 'added_by', 'participants')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_details()
+
+
+@admin.register(events.GameTitle)
+class GameTitleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'normalized')
+    search_fields = ('normalized', )
+
+
+@admin.register(availability.Availability)
+class AvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'weekday', 'start', 'end')
+    list_filter = ('weekday', )
+    raw_id_fields = ('user', )
@@ -21,3 +21,7 @@ from django.apps import AppConfig
 class GameNightPlannerConfig(AppConfig):
     name = 'gamenightplanner'
     verbose_name = "Game Night Planner"
+
+    def ready(self):
+        from . import cache, notifications, snapshots  # noqa: F401
+        from .models import availability, feeds  # noqa: F401
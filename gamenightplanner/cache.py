@@ -0,0 +1,285 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Cache for rendered calendar fragments
+
+Every day, week and month has a version stored in the cache and fragments
+are stored under keys that contain the version of the period they show.
+Changes to events, games or participants drop the versions of the periods
+that display the changed event, so stale fragments are never read again and
+simply expire. Recurring events may show up anywhere, so changes to them drop
+the version shared by all periods instead.
+
+Upcoming events and feed tokens of users are cached in the same way. Every
+user has a version that is dropped when they join or leave events, when
+events they host or participate in change and when their feed key changes.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils.timezone import now
+from uuid import uuid4
+from .account import get_feed_token
+from .dates import local_date
+from .layout import iso_week, week_dates
+from .models import archive, events, feeds
+
+KEY_PREFIX = 'gamenightplanner:calendar'
+
+ALL_PERIODS = 'all'
+
+UPCOMING_TIMEOUT = 60 * 60
+
+FEED_TOKEN_TIMEOUT = 24 * 60 * 60
+
+ARCHIVE_END_KEY = 'gamenightplanner:archive:end'
+
+
+def get_cache():
+    return caches[getattr(settings, 'GAMENIGHTPLANNER_CACHE', 'default')]
+
+
+def day_period(day):
+    return 'day:{:%Y-%m-%d}'.format(day)
+
+
+def week_period(year, week):
+    return 'week:{}-{}'.format(year, week)
+
+
+def month_period(year, month):
+    return 'month:{}-{}'.format(year, month)
+
+
+def affected_periods(day):
+    """Returns periods whose pages show given date
+
+    Month pages show whole weeks, so a date near the start or the end of a
+    month is visible on the neighbouring month's page as well.
+    """
+    year, week = iso_week(day)
+    monday, sunday = week_dates(year, week)
+    return {day_period(day), week_period(year, week),
+            month_period(monday.year, monday.month),
+            month_period(sunday.year, sunday.month)}
+
+
+def user_period(user_id):
+    return 'user:{}'.format(user_id)
+
+
+def version_key(period):
+    return '{}:version:{}'.format(KEY_PREFIX, period)
+
+
+def get_version(period):
+    cache = get_cache()
+    key = version_key(period)
+    version = cache.get(key)
+    if version is None:
+        # Random versions never collide with fragments of evicted versions
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def get_fragment_key(period, *vary):
+    return ':'.join(str(part) for part in (
+        KEY_PREFIX, period, get_version(period), get_version(ALL_PERIODS))
+        + vary)
+
+
+def get_upcoming_key(user_id):
+    return get_fragment_key(user_period(user_id), 'upcoming')
+
+
+def get_feed_token_key(user_id):
+    period = user_period(user_id)
+    return ':'.join((KEY_PREFIX, period, get_version(period), 'feed-token'))
+
+
+def get_upcoming_events(user, start, end, limit):
+    """Returns events of user within [start, end), cached per user
+
+    Cached lists expire when the first event in them starts.
+    """
+    cache = get_cache()
+    key = get_upcoming_key(user.pk)
+    found = cache.get(key)
+    if found is None:
+        found = events.Event.objects.for_user(user).select_related(
+                'host').occurrences(start, end)[:limit]
+        timeout = UPCOMING_TIMEOUT
+        if found:
+            timeout = min(timeout, (found[0].date - start).total_seconds())
+        cache.set(key, found, max(int(timeout), 1))
+    return found
+
+
+def get_cached_feed_token(user):
+    """Returns feed token of user, cached per user"""
+    cache = get_cache()
+    key = get_feed_token_key(user.pk)
+    token = cache.get(key)
+    if token is None:
+        token = get_feed_token(user)
+        cache.set(key, token, FEED_TOKEN_TIMEOUT)
+    return token
+
+
+def get_archive_end():
+    """Returns the end of the last archived event, None if there are none"""
+    cache = get_cache()
+    state = cache.get(ARCHIVE_END_KEY)
+    if state is None:
+        state = archive.ArchivedEvent.objects.aggregate(end=Max('last_end'))
+        cache.set(ARCHIVE_END_KEY, state, None)
+    return state['end']
+
+
+def get_event_querysets(start=None):
+    """Returns querysets of events and archived events starting after start
+
+    The archive is read only if it has events that ended after start, which
+    can not be the case for future ranges. No start means all events.
+    """
+    querysets = [events.Event.objects.all()]
+    if start is None or start < now():
+        archive_end = get_archive_end()
+        if archive_end is not None and (start is None or start < archive_end):
+            querysets.append(archive.ArchivedEvent.objects.all())
+    return querysets
+
+
+@receiver(archive.events_archived)
+def invalidate_archive_end(**kwargs):
+    get_cache().delete(ARCHIVE_END_KEY)
+
+
+def invalidate_users(user_ids):
+    get_cache().delete_many([version_key(user_period(pk))
+                             for pk in user_ids])
+
+
+def invalidate_dates(dates):
+    periods = set()
+    for value in dates:
+        if value is not None:
+            periods.update(affected_periods(local_date(value)))
+    if periods:
+        get_cache().delete_many([version_key(period) for period in periods])
+
+
+def invalidate_all():
+    get_cache().delete(version_key(ALL_PERIODS))
+
+
+def invalidate_events(rows):
+    """Invalidates periods of (date, original_date, recurrence) rows"""
+    dates = set()
+    for date, original_date, recurrence in rows:
+        if recurrence:
+            invalidate_all()
+            return
+        dates.update((date, original_date))
+    invalidate_dates(dates)
+
+
+def invalidate_queryset(queryset):
+    invalidate_events(queryset.values_list('date', 'original_date',
+                                           'recurrence'))
+
+
+def invalidate_instance(instance):
+    invalidate_events([(instance.date, instance.original_date,
+                        instance.recurrence)])
+
+
+def event_user_ids(instance):
+    """Returns ids of users whose upcoming events may contain the event
+
+    Those are the host and the participants of the event and, for
+    exceptions, of their series.
+    """
+    event_ids = [instance.pk]
+    user_ids = {instance.host_id}
+    if instance.series_id is not None:
+        event_ids.append(instance.series_id)
+        user_ids.update(events.Event.objects.filter(
+                pk=instance.series_id).values_list('host_id', flat=True))
+    user_ids.update(events.Event.participants.through.objects.filter(
+            event__in=event_ids).values_list('user_id', flat=True))
+    return user_ids
+
+
+@receiver(post_save, sender=events.Event)
+def event_saved(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    invalidate_events([(instance.date, instance.original_date,
+                        instance.recurrence),
+                       (loaded.get('date'), None, loaded.get('recurrence'))])
+    user_ids = event_user_ids(instance)
+    if loaded.get('host_id') is not None:
+        user_ids.add(loaded['host_id'])
+    invalidate_users(user_ids)
+
+
+@receiver(pre_delete, sender=events.Event)
+def event_deleting(sender, instance, **kwargs):
+    # Participants are deleted before post_delete is sent
+    invalidate_users(event_user_ids(instance))
+
+
+@receiver(post_delete, sender=events.Event)
+def event_deleted(sender, instance, **kwargs):
+    invalidate_instance(instance)
+
+
+@receiver(post_save, sender=feeds.FeedKey)
+def feed_key_saved(sender, instance, **kwargs):
+    invalidate_users([instance.user_id])
+
+
+@receiver(post_save, sender=events.Game)
+@receiver(post_delete, sender=events.Game)
+def game_changed(sender, instance, **kwargs):
+    invalidate_queryset(events.Event.objects.filter(pk=instance.event_id))
+
+
+@receiver(m2m_changed, sender=events.Event.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_instance(instance)
+        if action in ('post_add', 'post_remove'):
+            invalidate_users(pk_set)
+        elif action == 'pre_clear':
+            invalidate_users(instance.participants.values_list('pk',
+                                                               flat=True))
+        return
+    if action in ('post_add', 'post_remove'):
+        invalidate_queryset(events.Event.objects.filter(pk__in=pk_set))
+    elif action == 'pre_clear':
+        invalidate_queryset(instance.events.all())
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_users([instance.pk])
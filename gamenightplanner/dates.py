@@ -0,0 +1,60 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from datetime import datetime, time
+from django.conf import settings
+from django.utils.timezone import (get_current_timezone, localtime,
+                                   make_aware)
+
+
+def local_datetime(value):
+    """Returns given datetime as naive datetime in current time zone"""
+    if settings.USE_TZ:
+        value = localtime(value).replace(tzinfo=None)
+    return value
+
+
+def aware_datetime(value, is_dst=False):
+    """Returns naive datetime in current time zone as stored datetime
+
+    Times skipped by daylight saving time changes are moved forward and
+    repeated times are resolved by is_dst.
+    """
+    if settings.USE_TZ:
+        timezone = get_current_timezone()
+        value = timezone.normalize(make_aware(value, timezone, is_dst))
+    return value
+
+
+def start_of_day(day):
+    """Returns the datetime at which given date starts in current time zone
+
+    Days on which midnight is skipped start at the first valid time and days
+    on which it is repeated start at the first midnight.
+    """
+    midnight = datetime.combine(day, time())
+    value = aware_datetime(midnight, is_dst=True)
+    if local_datetime(value) != midnight:
+        # Skipped midnight was moved to the previous day
+        value = aware_datetime(midnight)
+    return value
+
+
+def local_date(value):
+    """Returns the date of given datetime in current time zone"""
+    return local_datetime(value).date()
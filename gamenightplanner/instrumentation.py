@@ -0,0 +1,183 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Optional timing of requests
+
+InstrumentationMiddleware records the number and duration of SQL queries,
+view and template rendering time and named spans recorded with timing() for
+each request. The numbers are sent in a Server-Timing header and logged to
+gamenightplanner.instrumentation logger as JSON. The middleware is enabled
+with GAMENIGHTPLANNER_INSTRUMENTATION setting, otherwise it removes itself
+and timing() does nothing but check a thread local.
+"""
+
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from json import dumps
+from logging import getLogger
+from threading import local
+from time import perf_counter
+
+logger = getLogger(__name__)
+
+_state = local()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.timings = OrderedDict()
+
+    def add(self, name, elapsed):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += perf_counter() - start
+            self.sql_count += 1
+
+
+def current_metrics():
+    return getattr(_state, 'metrics', None)
+
+
+@contextmanager
+def timing(name):
+    """Records time spent in the block or decorated function as name"""
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, perf_counter() - start)
+
+
+@contextmanager
+def capture_sql(metrics):
+    """Counts queries of all connections into metrics"""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            if hasattr(connection, 'execute_wrapper'):
+                stack.enter_context(connection.execute_wrapper(
+                        metrics.execute_wrapper))
+            else:
+                stack.enter_context(capture_debug_sql(connection, metrics))
+        yield
+
+
+class CountingQueriesLog:
+    """Counts queries into metrics as the debug cursor logs them
+
+    Counting when queries are appended works even when the bounded log drops
+    old queries. Everything else is passed to the wrapped log.
+    """
+    def __init__(self, queries_log, metrics):
+        self.queries_log = queries_log
+        self.metrics = metrics
+
+    def append(self, query):
+        self.queries_log.append(query)
+        self.metrics.sql_time += float(query['time'])
+        self.metrics.sql_count += 1
+
+    def __getattr__(self, name):
+        return getattr(self.queries_log, name)
+
+    def __iter__(self):
+        return iter(self.queries_log)
+
+    def __len__(self):
+        return len(self.queries_log)
+
+
+@contextmanager
+def capture_debug_sql(connection, metrics):
+    """Reads queries from debug cursor on Django versions before 2.0"""
+    force_debug_cursor = connection.force_debug_cursor
+    queries_log = connection.queries_log
+    connection.force_debug_cursor = True
+    connection.queries_log = CountingQueriesLog(queries_log, metrics)
+    try:
+        yield
+    finally:
+        connection.force_debug_cursor = force_debug_cursor
+        connection.queries_log = queries_log
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'GAMENIGHTPLANNER_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _state.metrics = RequestMetrics()
+        start = perf_counter()
+        try:
+            with capture_sql(metrics):
+                response = self.get_response(request)
+        finally:
+            _state.metrics = None
+        view_start = getattr(request, '_instrumentation_view_start', None)
+        if view_start is not None:
+            metrics.timings.setdefault('view', perf_counter() - view_start)
+        metrics.add('total', perf_counter() - start)
+        self.report(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumentation_view_start = perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics()
+        if metrics is not None:
+            render_start = perf_counter()
+            metrics.add('view',
+                        render_start - request._instrumentation_view_start)
+
+            def rendered(response):
+                metrics.add('template', perf_counter() - render_start)
+            response.add_post_render_callback(rendered)
+        return response
+
+    def report(self, request, response, metrics):
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else None
+        timings = [('sql', metrics.sql_time)] + list(metrics.timings.items())
+        response['Server-Timing'] = ', '.join(
+                ['sql;dur={:.1f};desc="{} queries"'.format(
+                    metrics.sql_time * 1000, metrics.sql_count)] +
+                ['{};dur={:.1f}'.format(name, elapsed * 1000)
+                 for name, elapsed in metrics.timings.items()])
+        logger.info(dumps(OrderedDict([
+            ('url_name', view_name),
+            ('method', request.method),
+            ('status', response.status_code),
+            ('sql_count', metrics.sql_count),
+        ] + [('{}_ms'.format(name), round(elapsed * 1000, 1))
+             for name, elapsed in timings])))
@@ -0,0 +1,97 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Calendar layout shared by calendar pages, forms and events
+
+Layouts of months and weeks never change, so they are computed once and
+shared as immutable tuples. Links depend on the script prefix of the
+installation and the URLconf in use, so they are cached separately for each
+of those.
+"""
+
+from calendar import Calendar, monthrange
+from collections import namedtuple
+from datetime import date
+from django.urls import get_script_prefix, get_urlconf, reverse
+from functools import lru_cache
+from isoweek import Week
+
+MonthWeek = namedtuple('MonthWeek', ['year', 'week', 'days'])
+
+MonthLayout = namedtuple('MonthLayout', ['year', 'month', 'weeks', 'days'])
+
+
+@lru_cache(maxsize=1024)
+def iso_week(day):
+    """Returns ISO (year, week) tuple of given date"""
+    return day.isocalendar()[:2]
+
+
+@lru_cache(maxsize=256)
+def get_week(year, week):
+    """Returns normalized isoweek.Week"""
+    return Week(year, week)
+
+
+@lru_cache(maxsize=256)
+def week_dates(year, week):
+    """Returns the Monday and the Sunday of given ISO week"""
+    week = get_week(year, week)
+    return week.monday(), week.sunday()
+
+
+def normalize_month(year, month):
+    """Returns (year, month) for month numbers outside of 1 to 12"""
+    year, month = divmod(year * 12 + month - 1, 12)
+    return year, month + 1
+
+
+@lru_cache(maxsize=256)
+def month_dates(year, month):
+    """Returns the first and the last day of given month"""
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+@lru_cache(maxsize=256)
+def get_month(year, month):
+    """Returns layout of the month page, i.e. whole weeks around the month"""
+    days = tuple(Calendar().itermonthdates(year, month))
+    weeks = tuple(MonthWeek(*iso_week(days[i]), days=days[i:i+7])
+                  for i in range(0, len(days), 7))
+    return MonthLayout(year, month, weeks, days)
+
+
+@lru_cache(maxsize=4096)
+def _link(prefix, urlconf, name, args):
+    return reverse(name, urlconf, args=args)
+
+
+def month_link(year, month):
+    return _link(get_script_prefix(), get_urlconf(), 'calendar:month',
+                 normalize_month(year, month))
+
+
+def week_link(year, week):
+    week = get_week(year, week)
+    return _link(get_script_prefix(), get_urlconf(), 'calendar:week',
+                 (week.year, week.week))
+
+
+def day_link(day):
+    return _link(get_script_prefix(), get_urlconf(), 'calendar:day',
+                 (day.year, day.month, day.day))
@@ -0,0 +1,44 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from ...dates import aware_datetime, local_datetime
+from ...models import archive
+from ...notifications import suppressed
+
+
+class Command(BaseCommand):
+    help = "Moves events that ended months ago to the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=12,
+                            help="archive events that ended this many "
+                                 "months ago")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        today = local_datetime(now()).replace(hour=0, minute=0, second=0,
+                                              microsecond=0)
+        month = today.year * 12 + today.month - 1 - options['months']
+        before = aware_datetime(today.replace(year=month // 12,
+                                              month=month % 12 + 1, day=1))
+        with suppressed():
+            moved = archive.archive_events(before, options['batch_size'])
+        self.stdout.write("Archived {} events that ended before {}".format(
+            moved, before))
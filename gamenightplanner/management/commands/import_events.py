@@ -0,0 +1,47 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from django.core.management.base import BaseCommand, CommandError
+from sys import stdin
+from ...transfer import FORMATS, import_rows, read_lines
+
+
+class Command(BaseCommand):
+    help = "Creates events from a file written by export_events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',
+                            help="file to read, - for standard input")
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['input'] == '-':
+            count = self.load(stdin, options)
+        else:
+            with open(options['input'], encoding='utf-8',
+                      newline='') as lines:
+                count = self.load(lines, options)
+        self.stdout.write("Imported {} events".format(count))
+
+    def load(self, lines, options):
+        try:
+            return import_rows(read_lines(lines, options['format']),
+                               options['batch_size'])
+        except (KeyError, ValueError) as error:
+            raise CommandError("Invalid input: {}".format(error))
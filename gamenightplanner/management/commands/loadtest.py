@@ -0,0 +1,148 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils.timezone import now
+from threading import Thread
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from ... import layout
+from ...dates import local_date
+from ...models import events
+
+
+class Command(BaseCommand):
+    help = ("Measures throughput and latency of read-only pages with "
+            "concurrent clients")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help="paths to request, current calendar pages "
+                                 "and the next event by default")
+        parser.add_argument('--base-url',
+                            help="server to request over HTTP, by default "
+                                 "the WSGI handler is called in this process")
+        parser.add_argument('--cookie',
+                            help="Cookie header to send over HTTP, e.g. "
+                                 "sessionid=...")
+        parser.add_argument('--user',
+                            help="username to log in as in this process")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200,
+                            help="total number of requests")
+
+    def get_default_paths(self):
+        today = local_date(now())
+        paths = [reverse('calendar:index'),
+                 layout.week_link(*layout.iso_week(today)),
+                 layout.day_link(today)]
+        event = events.Event.objects.upcoming().order_by('date').first()
+        if event is not None:
+            paths.append(event.get_absolute_url())
+        return paths
+
+    def get_requester(self, options):
+        """Returns a function that requests a path and returns its status"""
+        if options['base_url']:
+            headers = {}
+            if options['cookie']:
+                headers['Cookie'] = options['cookie']
+
+            def request(path):
+                try:
+                    with urlopen(Request(options['base_url'].rstrip('/') +
+                                         path, headers=headers)) as response:
+                        response.read()
+                        return response.status
+                except HTTPError as error:
+                    return error.code
+            return request
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS
+                     if host != '*'), 'localhost')
+        client = Client(HTTP_HOST=host)
+        if options['user']:
+            client.force_login(User.objects.get(username=options['user']))
+
+        def request(path):
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response.status_code
+        return request
+
+    def run_client(self, request, paths, count, results):
+        try:
+            for i in range(count):
+                path = paths[i % len(paths)]
+                start = perf_counter()
+                try:
+                    status = request(path)
+                except Exception as error:
+                    status = type(error).__name__
+                results.append((status, perf_counter() - start))
+        finally:
+            connections.close_all()
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("concurrency and requests must be positive")
+        paths = options['paths'] or self.get_default_paths()
+        results = []
+        counts = [options['requests'] // options['concurrency']] * \
+            options['concurrency']
+        for i in range(options['requests'] % options['concurrency']):
+            counts[i] += 1
+        counts = [count for count in counts if count]
+        threads = []
+        for i, count in enumerate(counts):
+            # Clients start from different paths to spread the load
+            offset = i % len(paths)
+            # Clients log in before the clock starts
+            threads.append(Thread(target=self.run_client, args=(
+                self.get_requester(options), paths[offset:] + paths[:offset],
+                count, results)))
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        self.report(paths, results, elapsed)
+
+    def report(self, paths, results, elapsed):
+        times = sorted(time for status, time in results)
+        if not times:
+            raise CommandError("No requests were made")
+        percentiles = [times[min(len(times) - 1, len(times) * p // 100)]
+                       * 1000 for p in (50, 90, 99)]
+        self.stdout.write("Paths: {}".format(", ".join(paths)))
+        self.stdout.write("{} requests in {:.2f} s, {:.1f} requests/s".format(
+            len(results), elapsed, len(results) / elapsed))
+        self.stdout.write("Latency p50 {:.1f} ms, p90 {:.1f} ms, "
+                          "p99 {:.1f} ms".format(*percentiles))
+        statuses = Counter(status for status, time in results)
+        self.stdout.write("Statuses: {}".format(", ".join(
+            "{}: {}".format(status, count)
+            for status, count in sorted(statuses.items(), key=str))))
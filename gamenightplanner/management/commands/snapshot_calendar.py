@@ -0,0 +1,49 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from ...models import archive
+from ...snapshots import create_snapshots, get_root, remove_all
+
+
+class Command(BaseCommand):
+    help = "Renders snapshots of calendar pages showing archived events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="render existing snapshots again")
+        parser.add_argument('--clear', action='store_true',
+                            help="remove all snapshots instead")
+
+    def handle(self, *args, **options):
+        if get_root() is None:
+            raise CommandError("GAMENIGHTPLANNER_SNAPSHOT_ROOT is not set")
+        if options['clear']:
+            remove_all()
+            self.stdout.write("Removed all snapshots")
+            return
+        dates = archive.ArchivedEvent.objects.aggregate(
+                start=Min('date'), end=Max('last_end'))
+        count = 0
+        if dates['start'] is not None:
+            count = create_snapshots(dates['start'],
+                                     dates['end'] + timedelta(days=1),
+                                     options['rebuild'])
+        self.stdout.write("Rendered {} snapshots".format(count))
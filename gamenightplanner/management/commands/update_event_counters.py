@@ -0,0 +1,50 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from ...models import events
+
+
+class Command(BaseCommand):
+    help = "Fixes participant and game counts of events that have drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="only report events with wrong counts")
+
+    def handle(self, *args, **options):
+        queryset = events.Event.objects.order_by().annotate(
+            actual_participants=Count('participants', distinct=True),
+            actual_games=Count('games', distinct=True)).values_list(
+            'pk', 'participant_count', 'game_count', 'actual_participants',
+            'actual_games')
+        # Collected first, updating rows while iterating is unsafe on SQLite
+        drifted = [(pk, participants, games) for
+                   pk, old_participants, old_games, participants, games in
+                   queryset.iterator()
+                   if (old_participants, old_games) != (participants, games)]
+        for pk, participants, games in drifted:
+            if options['verbosity'] > 1:
+                self.stdout.write("Event {}: {} participants, {} games".format(
+                    pk, participants, games))
+            if not options['dry_run']:
+                events.Event.objects.filter(pk=pk).update(
+                    participant_count=participants, game_count=games)
+        self.stdout.write("{} {} events with wrong counts".format(
+            "Found" if options['dry_run'] else "Fixed", len(drifted)))
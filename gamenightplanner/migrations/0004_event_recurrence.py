@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Generated by Django 1.11.29 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gamenightplanner', '0003_event_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='cancelled',
+            field=models.BooleanField(default=False, verbose_name='cancelled'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='original_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='original date'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence',
+            field=models.CharField(blank=True, choices=[('', 'does not repeat'), ('weekly', 'weekly'), ('biweekly', 'every other week'), ('monthly', 'monthly')], default='', max_length=8, verbose_name='repeats'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='number of occurrences'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_end',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='repeats until'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='gamenightplanner.Event', verbose_name='series'),
+        ),
+        migrations.AlterIndexTogether(
+            name='event',
+            index_together=set([('host', 'date'), ('series', 'original_date')]),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Generated by Django 1.11.29 on 2026-10-18 10:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_related(apps, schema_editor):
+    Event = apps.get_model('gamenightplanner', 'Event')
+    queryset = Event.objects.annotate(
+        participants_total=Count('participants', distinct=True),
+        games_total=Count('games', distinct=True)).values_list(
+        'pk', 'participants_total', 'games_total')
+    for pk, participants, games in list(queryset):
+        Event.objects.filter(pk=pk).update(participant_count=participants,
+                                           game_count=games)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamenightplanner', '0004_event_recurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='game_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='games'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='participants'),
+        ),
+        migrations.RunPython(count_related, migrations.RunPython.noop),
+    ]
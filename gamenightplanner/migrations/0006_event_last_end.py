@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Generated by Django 1.11.29 on 2026-10-18 10:25
+from __future__ import unicode_literals
+
+from datetime import timedelta
+from django.db import migrations, models
+
+
+def set_last_end(apps, schema_editor):
+    Event = apps.get_model('gamenightplanner', 'Event')
+    rows = Event.objects.values_list('pk', 'date', 'length', 'recurrence',
+                                     'recurrence_end')
+    for pk, date, length, recurrence, recurrence_end in list(rows):
+        last_start = recurrence_end if recurrence else date
+        if last_start is not None:
+            Event.objects.filter(pk=pk).update(
+                last_end=last_start + (length or timedelta()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamenightplanner', '0005_event_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='last_end',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(set_last_end, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Generated by Django 1.11.29 on 2026-10-18 10:29
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Partial indexes are not supported by all databases or by Django 1.11
+PARTIAL_INDEXES = {
+    'postgresql': [
+        ('gamenightplanner_event_upcoming', 'date',
+         "recurrence = '' AND NOT cancelled"),
+        ('gamenightplanner_event_series', 'recurrence_end',
+         "recurrence <> '' AND NOT cancelled"),
+    ],
+    'sqlite': [
+        ('gamenightplanner_event_upcoming', 'date',
+         "recurrence = '' AND cancelled = 0"),
+        ('gamenightplanner_event_series', 'recurrence_end',
+         "recurrence <> '' AND cancelled = 0"),
+    ],
+}
+
+
+def create_partial_indexes(apps, schema_editor):
+    for name, column, condition in PARTIAL_INDEXES.get(
+            schema_editor.connection.vendor, []):
+        schema_editor.execute(
+            'CREATE INDEX {} ON gamenightplanner_event ({}) WHERE {}'.format(
+                name, column, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    for name, column, condition in PARTIAL_INDEXES.get(
+            schema_editor.connection.vendor, []):
+        schema_editor.execute('DROP INDEX {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gamenightplanner', '0006_event_last_end'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('added', models.DateTimeField(default=django.utils.timezone.now, verbose_name='added')),
+                ('date', models.DateTimeField(db_index=True, verbose_name='date')),
+                ('length', models.DurationField(null=True, verbose_name='length')),
+                ('recurrence', models.CharField(blank=True, choices=[('', 'does not repeat'), ('weekly', 'weekly'), ('biweekly', 'every other week'), ('monthly', 'monthly')], default='', max_length=8, verbose_name='repeats')),
+                ('recurrence_count', models.PositiveIntegerField(blank=True, null=True, verbose_name='number of occurrences')),
+                ('recurrence_until', models.DateTimeField(blank=True, null=True, verbose_name='repeats until')),
+                ('recurrence_end', models.DateTimeField(editable=False, null=True)),
+                ('last_end', models.DateTimeField(db_index=True, editable=False, null=True)),
+                ('original_date', models.DateTimeField(blank=True, null=True, verbose_name='original date')),
+                ('cancelled', models.BooleanField(default=False, verbose_name='cancelled')),
+                ('participant_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='participants')),
+                ('game_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='games')),
+                ('updated', models.DateTimeField(verbose_name='updated')),
+                ('added_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='added by')),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='host')),
+            ],
+            options={
+                'verbose_name': 'archived event',
+                'verbose_name_plural': 'archived events',
+                'ordering': ('date',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedGame',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, verbose_name='name')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='games', to='gamenightplanner.ArchivedEvent', verbose_name='event')),
+            ],
+            options={
+                'verbose_name': 'archived game',
+                'verbose_name_plural': 'archived games',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedParticipation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gamenightplanner.ArchivedEvent', verbose_name='event')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedevent',
+            name='participants',
+            field=models.ManyToManyField(related_name='_archivedevent_participants_+', through='gamenightplanner.ArchivedParticipation', to=settings.AUTH_USER_MODEL, verbose_name='participants'),
+        ),
+        migrations.AddField(
+            model_name='archivedevent',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='gamenightplanner.ArchivedEvent', verbose_name='series'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedparticipation',
+            unique_together=set([('event', 'user')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
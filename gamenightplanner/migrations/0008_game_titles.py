@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Generated by Django 1.11.29 on 2026-10-18 11:02
+from __future__ import unicode_literals
+
+from collections import Counter, defaultdict
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def clean_title(name):
+    return ' '.join(name.split())
+
+
+def create_titles(apps, schema_editor):
+    """Creates a title for every distinct name, spelled the most common way"""
+    Game = apps.get_model('gamenightplanner', 'Game')
+    GameTitle = apps.get_model('gamenightplanner', 'GameTitle')
+    spellings = defaultdict(Counter)
+    for name in Game.objects.values_list('name', flat=True).iterator():
+        spellings[clean_title(name).casefold()][name] += 1
+    GameTitle.objects.bulk_create(
+            GameTitle(name=clean_title(names.most_common(1)[0][0]),
+                      normalized=normalized)
+            for normalized, names in spellings.items())
+    for normalized, pk in GameTitle.objects.values_list('normalized', 'pk'):
+        Game.objects.filter(name__in=spellings[normalized]).update(
+                title_id=pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamenightplanner', '0007_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameTitle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, verbose_name='name')),
+                ('normalized', models.CharField(editable=False, max_length=256, unique=True)),
+            ],
+            options={
+                'verbose_name': 'game title',
+                'verbose_name_plural': 'game titles',
+                'ordering': ('normalized',),
+            },
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='title',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='games', to='gamenightplanner.GameTitle', verbose_name='title'),
+        ),
+        migrations.RunPython(create_titles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+# Generated by Django 1.11.29 on 2026-10-18 11:40
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# Expression indexes are not supported by all databases or by Django 1.11.
+# Users without email are left out, so that they do not collide.
+EMAIL_INDEX = 'gamenightplanner_user_email_lower'
+
+VENDORS = ('postgresql', 'sqlite')
+
+
+def create_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in VENDORS:
+        return
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    schema_editor.execute(
+        "CREATE UNIQUE INDEX {} ON {} (LOWER(email)) WHERE email <> ''"
+        .format(EMAIL_INDEX, User._meta.db_table))
+
+
+def drop_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor in VENDORS:
+        schema_editor.execute('DROP INDEX {}'.format(EMAIL_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gamenightplanner', '0009_game_title_required'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -20,7 +20,8 @@ from django.db import models
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
-__all__ = ['events', 'AddedInfoModelMixin']
+__all__ = ['archive', 'availability', 'events', 'feeds',
+           'AddedInfoModelMixin']
 
 
 class AddedInfoModelMixin(models.Model):
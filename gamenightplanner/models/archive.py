@@ -0,0 +1,125 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Events moved out of the events table
+
+Events that ended long ago are moved here by the archive_events command, so
+that they do not slow down queries of current events. Archived events keep
+their ids and can not be changed.
+"""
+
+from . import events
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.dispatch import Signal
+from django.utils.translation import ugettext_lazy as _
+
+events_archived = Signal(providing_args=['before', 'moved'])
+
+
+class ArchivedEvent(events.BaseEvent):
+    class Meta:
+        verbose_name = _("archived event")
+        verbose_name_plural = _("archived events")
+        ordering = ('date', )
+
+    # Keeps the time of the last change before archiving
+    updated = models.DateTimeField(verbose_name=_("updated"))
+
+    host = models.ForeignKey(User, related_name='+', verbose_name=_("host"))
+
+    participants = models.ManyToManyField(User, related_name='+',
+                                          through='ArchivedParticipation',
+                                          verbose_name=_("participants"))
+
+    series = models.ForeignKey('self', null=True, blank=True,
+                               related_name='exceptions',
+                               verbose_name=_("series"))
+
+    objects = events.EventQuerySet.as_manager()
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedParticipation(models.Model):
+    class Meta:
+        unique_together = ('event', 'user')
+
+    event = models.ForeignKey(ArchivedEvent, verbose_name=_("event"))
+
+    user = models.ForeignKey(User, related_name='+', verbose_name=_("user"))
+
+
+class ArchivedGame(models.Model):
+    class Meta:
+        verbose_name = _("archived game")
+        verbose_name_plural = _("archived games")
+
+    event = models.ForeignKey(ArchivedEvent, related_name='games',
+                              verbose_name=_("event"))
+
+    name = models.CharField(max_length=256, verbose_name=_("name"))
+
+    def __str__(self):
+        return self.name
+
+
+def archive_events(before, batch_size=500):
+    """Moves events and series that ended before given time to the archive
+
+    Exceptions are moved along with their series. Sends events_archived
+    when done and returns the number of moved events.
+    """
+    fields = [field.attname for field in events.Event._meta.concrete_fields]
+    roots = events.Event.objects.filter(
+            series__isnull=True, last_end__lt=before).order_by(
+            'pk').values_list('pk', flat=True)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            ids = list(roots[:batch_size])
+            if not ids:
+                break
+            rows = events.Event.objects.filter(
+                    models.Q(pk__in=ids) | models.Q(series__in=ids)).values(
+                    *fields)
+            archived = [ArchivedEvent(**row) for row in rows]
+            # Series must exist before their exceptions
+            archived.sort(key=lambda event: event.series_id is not None)
+            pks = [event.pk for event in archived]
+            ArchivedEvent.objects.bulk_create(archived)
+            ArchivedGame.objects.bulk_create(
+                    ArchivedGame(event_id=event_id, name=name)
+                    for event_id, name in events.Game.objects.filter(
+                        event__in=pks).values_list('event_id', 'name'))
+            ArchivedParticipation.objects.bulk_create(
+                    ArchivedParticipation(event_id=event_id, user_id=user_id)
+                    for event_id, user_id in
+                    events.Event.participants.through.objects.filter(
+                        event__in=pks).values_list('event_id', 'user_id'))
+            events.Event.objects.filter(pk__in=pks).delete()
+            moved += len(pks)
+    events_archived.send(ArchivedEvent, before=before, moved=moved)
+    return moved
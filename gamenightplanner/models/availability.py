@@ -0,0 +1,62 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Weekly windows of time when users are available for game nights"""
+
+from datetime import time
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class Availability(models.Model):
+    class Meta:
+        verbose_name = _("availability")
+        verbose_name_plural = _("availabilities")
+        ordering = ('weekday', 'start')
+
+    WEEKDAY_CHOICES = (
+        (0, _("Monday")),
+        (1, _("Tuesday")),
+        (2, _("Wednesday")),
+        (3, _("Thursday")),
+        (4, _("Friday")),
+        (5, _("Saturday")),
+        (6, _("Sunday")),
+    )
+
+    user = models.ForeignKey(User, related_name='availabilities',
+                             verbose_name=_("user"))
+
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES,
+                                               verbose_name=_("weekday"))
+
+    # Local times, end of 00:00 means midnight at the end of the day
+    start = models.TimeField(verbose_name=_("from"))
+
+    end = models.TimeField(verbose_name=_("until"))
+
+    def __str__(self):
+        return "{} {:%H:%M}-{:%H:%M}".format(self.get_weekday_display(),
+                                             self.start, self.end)
+
+    def clean(self):
+        if (self.start is not None and self.end is not None and
+                self.end != time() and self.end <= self.start):
+            raise ValidationError(_("availability must end after it starts"))
@@ -16,39 +16,311 @@
 # <http://www.gnu.org/licenses/>.
 
 from . import AddedInfoModelMixin
+from calendar import monthrange
+from copy import copy
+from datetime import timedelta
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
-from isoweek import Week
+from heapq import merge
+from itertools import groupby, islice
+from operator import attrgetter
+from ..dates import aware_datetime, local_datetime
+from ..layout import iso_week
 
 
-class Event(AddedInfoModelMixin, models.Model):
+class EventQuerySet(models.QuerySet):
+    def with_details(self):
+        """Loads hosts and games along with events"""
+        return self.select_related('host').prefetch_related('games')
+
+    def upcoming(self):
+        """Filters events and series that are not archived
+
+        Partial indexes created in migration 0007 cover this query.
+        """
+        current = now()
+        single = models.Q(recurrence='', date__gte=current)
+        series = ~models.Q(recurrence='') & (
+                models.Q(recurrence_end__isnull=True) |
+                models.Q(recurrence_end__gte=current))
+        return self.filter(single | series, cancelled=False)
+
+    def archived(self):
+        """Filters events and series that are archived"""
+        current = now()
+        single = models.Q(recurrence='', date__lt=current)
+        series = ~models.Q(recurrence='') & models.Q(
+                recurrence_end__lt=current)
+        return self.filter(single | series)
+
+    def for_user(self, user):
+        """Filters events the user hosts or participates in
+
+        Exceptions of such series are included, so that the series can be
+        expanded correctly.
+        """
+        joined = self.model.participants.through.objects.filter(
+                user=user).values('event_id')
+        return self.filter(models.Q(host=user) | models.Q(pk__in=joined) |
+                           models.Q(series__host=user) |
+                           models.Q(series__in=joined))
+
+    def in_range(self, start, end):
+        """Filters events, series and exceptions that affect [start, end)
+
+        The result contains single events starting within the range, series
+        that may have occurrences within it and exceptions that replace their
+        occurrences, whether or not the exception itself was moved away.
+        """
+        single = models.Q(recurrence='', date__gte=start, date__lt=end)
+        replaced = models.Q(series__isnull=False, original_date__gte=start,
+                            original_date__lt=end)
+        series = (~models.Q(recurrence='') & models.Q(date__lt=end) &
+                  (models.Q(recurrence_end__isnull=True) |
+                   models.Q(recurrence_end__gte=start)))
+        return self.filter(single | replaced | series)
+
+    def occurrences(self, start, end, limit=None):
+        """Returns events and occurrences of series within [start, end)
+
+        Series are expanded only for the range, so this costs one query no
+        matter how long the series are. Given limit, expansion stops after
+        that many events.
+        """
+        found, series, replaced = [], [], set()
+        for event in self.in_range(start, end):
+            if event.recurrence:
+                series.append(event)
+                continue
+            if event.series_id is not None:
+                replaced.add((event.series_id, event.original_date))
+            if not event.cancelled and start <= event.date < end:
+                found.append(event)
+
+        def expand(event):
+            for date in event.occurrence_dates(start, end):
+                if (event.pk, date) not in replaced:
+                    yield event.occurrence(date)
+
+        key = attrgetter('date', 'pk')
+        found.sort(key=key)
+        return list(islice(merge(found, *map(expand, series), key=key),
+                           limit))
+
+    def overlapping(self, start, end):
+        """Returns events and occurrences of series that overlap [start, end)
+
+        Events that ended before start are skipped with the index on
+        last_end, so the query does not slow down as history grows.
+        Exceptions of found series are read with another query.
+        """
+        found, series = [], []
+        not_ended = (models.Q(last_end__gt=start) |
+                     models.Q(last_end__isnull=True) | models.Q(date=start))
+        for event in self.filter(not_ended, date__lt=end):
+            if event.recurrence:
+                series.append(event)
+            elif not event.cancelled:
+                found.append(event)
+        if series:
+            longest = max(event.length or timedelta() for event in series)
+            replaced = set(self.model.objects.filter(
+                    series__in=series, original_date__lt=end,
+                    original_date__gte=start - longest).values_list(
+                    'series_id', 'original_date'))
+            for event in series:
+                length = event.length or timedelta()
+                for date in event.occurrence_dates(start - length, end):
+                    if ((event.pk, date) not in replaced and
+                            overlaps(date, date + length, start, end)):
+                        found.append(event.occurrence(date))
+        found.sort(key=lambda event: (event.date, event.pk))
+        return found
+
+    def iter_related(self, model, field):
+        """Iterates (event id, list of values) pairs ordered by event id"""
+        rows = model.objects.filter(
+                event__in=self.order_by().values('pk')).order_by(
+                'event_id', 'pk').values_list('event_id', field).iterator()
+        for pk, group in groupby(rows, key=lambda row: row[0]):
+            yield pk, [row[1] for row in group]
+
+    def playing(self, name):
+        """Filters events that play a game with given title"""
+        games = self.model._meta.get_field('games').related_model
+        return self.filter(pk__in=games.objects.filter(
+                title__normalized=normalize_title(name)).values('event_id'))
+
+    def iter_with_related(self, *fields):
+        """Iterates (values, game names, participant usernames) of events
+
+        Games and participants are read with one query each and merged with
+        events by id, so memory use does not grow with the number of events.
+        """
+        games = self.iter_related(
+                self.model._meta.get_field('games').related_model, 'name')
+        participants = self.iter_related(self.model.participants.through,
+                                         'user__username')
+        game, participant = next(games, None), next(participants, None)
+        for event in self.order_by('pk').values('pk', *fields).iterator():
+            pk = event['pk']
+            while game is not None and game[0] < pk:
+                game = next(games, None)
+            while participant is not None and participant[0] < pk:
+                participant = next(participants, None)
+            yield (event,
+                   game[1] if game is not None and game[0] == pk else [],
+                   participant[1] if participant is not None and
+                   participant[0] == pk else [])
+
+
+def overlaps(start, end, other_start, other_end):
+    """Tells whether [start, end) and [other_start, other_end) overlap
+
+    Events without length overlap events that start at the same time.
+    """
+    return start == other_start or (start < other_end and other_start < end)
+
+
+def iter_overlaps(found):
+    """Iterates pairs of overlapping events from events sorted by date"""
+    active = []
+    for event in found:
+        end = event.date + (event.length or timedelta())
+        active = [(other_end, other) for other_end, other in active
+                  if overlaps(other.date, other_end, event.date, end)]
+        for other_end, other in active:
+            yield other, event
+        active.append((end, event))
+
+
+class BaseEvent(AddedInfoModelMixin, models.Model):
+    """Fields and behaviour shared by events and archived events"""
     class Meta:
-        verbose_name = _("event")
-        verbose_name_plural = _("events")
-        ordering = ('date', )
+        abstract = True
+
+    RECURRENCE_CHOICES = (
+        ('', _("does not repeat")),
+        ('weekly', _("weekly")),
+        ('biweekly', _("every other week")),
+        ('monthly', _("monthly")),
+    )
+
+    RECURRENCE_DAYS = {'weekly': 7, 'biweekly': 14}
 
-    date = models.DateTimeField(verbose_name=_("date"))
+    date = models.DateTimeField(verbose_name=_("date"), db_index=True)
 
     length = models.DurationField(verbose_name=_("length"), null=True)
 
-    host = models.ForeignKey(User, related_name='hosted_events',
-                             verbose_name=_("host"))
+    updated = models.DateTimeField(auto_now=True, verbose_name=_("updated"))
 
-    participants = models.ManyToManyField(User, related_name='events',
-                                          verbose_name=_("participants"))
+    recurrence = models.CharField(max_length=8, blank=True, default='',
+                                  choices=RECURRENCE_CHOICES,
+                                  verbose_name=_("repeats"))
+
+    recurrence_count = models.PositiveIntegerField(
+            null=True, blank=True, verbose_name=_("number of occurrences"))
+
+    recurrence_until = models.DateTimeField(null=True, blank=True,
+                                            verbose_name=_("repeats until"))
+
+    # Start of the last occurrence or None if the series does not end
+    recurrence_end = models.DateTimeField(null=True, editable=False)
+
+    # End of the event or its last occurrence, None if it does not end
+    last_end = models.DateTimeField(null=True, editable=False, db_index=True)
+
+    original_date = models.DateTimeField(
+            null=True, blank=True, verbose_name=_("original date"))
+
+    cancelled = models.BooleanField(default=False,
+                                    verbose_name=_("cancelled"))
+
+    # Kept up to date by signal handlers below, see update_event_counters
+    participant_count = models.PositiveIntegerField(
+            default=0, editable=False, verbose_name=_("participants"))
+
+    game_count = models.PositiveIntegerField(default=0, editable=False,
+                                             verbose_name=_("games"))
 
     def __str__(self):
         return "Event on {} hosted by {} with {} participants".format(
-                self.date, self.host.username, self.participants.count())
+                self.date, self.host.username, self.participant_count)
+
+    def update_end_dates(self):
+        if not self.recurrence:
+            self.recurrence_end = None
+        elif self.recurrence_count is not None:
+            self.recurrence_end = self.nth_occurrence(
+                    max(self.recurrence_count - 1, 0))
+        else:
+            self.recurrence_end = self.recurrence_until
+        last_start = self.date if not self.recurrence else self.recurrence_end
+        if last_start is None:
+            self.last_end = None
+        else:
+            self.last_end = last_start + (self.length or timedelta())
 
     def get_absolute_url(self):
         return reverse('events:show', args=(self.id, ))
 
+    def nth_occurrence(self, n):
+        """Returns start of nth occurrence counting from zero
+
+        Occurrences keep the local time of day. Monthly series fall on the
+        last day of shorter months.
+        """
+        first = local_datetime(self.date)
+        if self.recurrence == 'monthly':
+            month = first.month - 1 + n
+            year, month = first.year + month // 12, month % 12 + 1
+            day = min(first.day, monthrange(year, month)[1])
+            return aware_datetime(first.replace(year=year, month=month,
+                                                day=day))
+        days = self.RECURRENCE_DAYS[self.recurrence] * n
+        return aware_datetime(first + timedelta(days=days))
+
+    def occurrence_dates(self, start, end):
+        """Iterates starts of occurrences within [start, end)"""
+        if not self.recurrence:
+            if start <= self.date < end:
+                yield self.date
+            return
+        first, start_local = local_datetime(self.date), local_datetime(start)
+        if self.recurrence == 'monthly':
+            n = ((start_local.year - first.year) * 12 + start_local.month -
+                 first.month - 1)
+        else:
+            n = ((start_local - first).days //
+                 self.RECURRENCE_DAYS[self.recurrence] - 1)
+        n = max(n, 0)
+        while self.nth_occurrence(n) < start:
+            n += 1
+        while self.recurrence_count is None or n < self.recurrence_count:
+            date = self.nth_occurrence(n)
+            if date >= end or (self.recurrence_until is not None and
+                               date > self.recurrence_until):
+                return
+            yield date
+            n += 1
+
+    def occurrence(self, date):
+        """Returns unsaved copy of a series for an occurrence on date"""
+        occurrence = copy(self)
+        occurrence.date = date
+        occurrence.original_date = date
+        return occurrence
+
     @property
     def archived(self):
+        if self.recurrence:
+            return (self.recurrence_end is not None and
+                    self.recurrence_end < now())
         return self.date < now()
 
     @property
@@ -57,7 +329,97 @@ class Event(AddedInfoModelMixin, models.Model):
 
     @property
     def week(self):
-        return Week.withdate(self.date).week
+        return iso_week(self.date.date())[1]
+
+
+class Event(BaseEvent):
+    class Meta:
+        verbose_name = _("event")
+        verbose_name_plural = _("events")
+        ordering = ('date', )
+        index_together = [('host', 'date'), ('series', 'original_date')]
+
+    # How far ahead occurrences of series are checked for conflicts
+    CONFLICT_DAYS = 90
+
+    host = models.ForeignKey(User, related_name='hosted_events',
+                             verbose_name=_("host"))
+
+    participants = models.ManyToManyField(User, related_name='events',
+                                          verbose_name=_("participants"))
+
+    series = models.ForeignKey('self', null=True, blank=True,
+                               related_name='exceptions',
+                               verbose_name=_("series"))
+
+    objects = EventQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember stored values to know what a change affects
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    COUNTERS = ('participant_count', 'game_count')
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not kwargs.get('force_insert') and
+                kwargs.get('update_fields') is None):
+            # Counters are updated with F() expressions, never overwrite them
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS
+                and field.attname not in deferred]
+        self.update_end_dates()
+        super().save(*args, **kwargs)
+        # The next save is compared with what is stored now
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred}
+
+    def get_conflicts(self, user):
+        """Returns events of user that overlap with this event
+
+        Occurrences of series are checked for the next CONFLICT_DAYS.
+        """
+        if not self.recurrence:
+            periods = [self]
+        else:
+            start = max(self.date, now())
+            end = start + timedelta(days=self.CONFLICT_DAYS)
+            replaced = set()
+            if self.pk is not None:
+                replaced = set(self.exceptions.values_list('original_date',
+                                                           flat=True))
+            periods = [self.occurrence(date) for date in
+                       self.occurrence_dates(start, end)
+                       if date not in replaced]
+        if not periods:
+            return []
+        start = periods[0].date
+        end = max(start + timedelta(microseconds=1),
+                  periods[-1].date + (self.length or timedelta()))
+        others = Event.objects.for_user(user).select_related('host')
+        if self.pk is not None:
+            related = models.Q(pk=self.pk) | models.Q(series=self.pk)
+            if self.series_id is not None:
+                related |= (models.Q(pk=self.series_id) |
+                            models.Q(series=self.series_id))
+            others = others.exclude(related)
+        found = sorted(periods + others.overlapping(start, end),
+                       key=lambda event: event.date)
+        own = {id(period) for period in periods}
+        conflicts = []
+        for first, second in iter_overlaps(found):
+            if (id(first) in own) != (id(second) in own):
+                other = second if id(first) in own else first
+                if other not in conflicts:
+                    conflicts.append(other)
+        return conflicts
 
     def has_add_permission(self, request):
         if request.user.is_authenticated:
@@ -69,7 +431,7 @@ class Event(AddedInfoModelMixin, models.Model):
             return True
         if obj.archived:
             return False
-        if obj.added_by == request.user or obj.host == request.user:
+        if request.user.pk in (obj.added_by_id, obj.host_id):
             return True
         return False
 
@@ -77,6 +439,62 @@ class Event(AddedInfoModelMixin, models.Model):
         return self.has_change_permission(request, obj)
 
 
+def clean_title(name):
+    """Returns game title without extra whitespace"""
+    return ' '.join(name.split())
+
+
+def normalize_title(name):
+    """Returns game title in the form used to tell titles apart"""
+    return clean_title(name).casefold()
+
+
+class GameTitleQuerySet(models.QuerySet):
+    def search(self, prefix):
+        """Filters titles starting with prefix using the normalized index"""
+        return self.filter(normalized__startswith=normalize_title(prefix))
+
+    def get_ids(self, names):
+        """Returns dict of title ids by normalized names, creating titles
+        that do not exist yet"""
+        titles = {}
+        for name in names:
+            titles.setdefault(normalize_title(name), clean_title(name))
+        ids = dict(self.filter(normalized__in=titles).values_list(
+                'normalized', 'pk'))
+        missing = [self.model(name=name, normalized=normalized)
+                   for normalized, name in titles.items()
+                   if normalized not in ids]
+        if missing:
+            self.bulk_create(missing)
+            ids.update(self.filter(normalized__in=[
+                title.normalized for title in missing]).values_list(
+                'normalized', 'pk'))
+        return ids
+
+
+class GameTitle(models.Model):
+    class Meta:
+        verbose_name = _("game title")
+        verbose_name_plural = _("game titles")
+        ordering = ('normalized', )
+
+    name = models.CharField(max_length=256, verbose_name=_("name"))
+
+    normalized = models.CharField(max_length=256, unique=True,
+                                  editable=False)
+
+    objects = GameTitleQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        self.name = clean_title(self.name)
+        self.normalized = normalize_title(self.name)
+        super().save(*args, **kwargs)
+
+
 class Game(models.Model):
     class Meta:
         verbose_name = _("game")
@@ -87,5 +505,76 @@ class Game(models.Model):
 
     name = models.CharField(max_length=256, verbose_name=_("name"))
 
+    title = models.ForeignKey(GameTitle, models.PROTECT,
+                              related_name='games', editable=False,
+                              verbose_name=_("title"))
+
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        """Links the game to the catalog entry of its title"""
+        normalized = normalize_title(self.name)
+        if self.title_id is None or self.title.normalized != normalized:
+            self.title = GameTitle.objects.get_or_create(
+                    normalized=normalized,
+                    defaults={'name': clean_title(self.name)})[0]
+        super().save(*args, **kwargs)
+
+
+@receiver(post_save, sender=Game)
+def count_added_game(sender, instance, created, **kwargs):
+    changes = {'updated': now()}
+    if created:
+        changes['game_count'] = models.F('game_count') + 1
+    Event.objects.filter(pk=instance.event_id).update(**changes)
+
+
+@receiver(post_delete, sender=Game)
+def count_deleted_game(sender, instance, **kwargs):
+    Event.objects.filter(pk=instance.event_id).update(
+            game_count=models.F('game_count') - 1, updated=now())
+
+
+@receiver(m2m_changed, sender=Event.participants.through)
+def count_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """Updates participant counts and modification times of events
+
+    Removal signals get all given ids, so rows that really exist are looked
+    up before removing to keep the counts exact.
+    """
+    through = Event.participants.through
+    if not reverse:
+        events = Event.objects.filter(pk=instance.pk)
+        if action == 'post_add':
+            change = len(pk_set)
+        elif action == 'pre_remove':
+            instance._removed_participants = through.objects.filter(
+                    event=instance, user__in=pk_set).count()
+            return
+        elif action == 'post_remove':
+            change = -instance._removed_participants
+        elif action == 'post_clear':
+            instance.participant_count = 0
+            events.update(participant_count=0, updated=now())
+            return
+        else:
+            return
+        instance.participant_count += change
+    else:
+        if action == 'post_add':
+            events, change = Event.objects.filter(pk__in=pk_set), 1
+        elif action in ('pre_remove', 'pre_clear'):
+            removed = through.objects.filter(user=instance)
+            if action == 'pre_remove':
+                removed = removed.filter(event__in=pk_set)
+            instance._removed_events = list(removed.values_list('event_id',
+                                                                flat=True))
+            return
+        elif action in ('post_remove', 'post_clear'):
+            events = Event.objects.filter(pk__in=instance._removed_events)
+            change = -1
+        else:
+            return
+    events.update(participant_count=models.F('participant_count') + change,
+                  updated=now())
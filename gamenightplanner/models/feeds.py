@@ -0,0 +1,47 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Keys of calendar feed urls of users
+
+Feed urls contain a token signed with the key of the user, so that the urls
+of a user can be revoked by changing the key.
+"""
+
+from django.contrib.auth.models import User
+from django.db import models
+from django.utils.crypto import get_random_string
+from django.utils.translation import ugettext_lazy as _
+
+
+def new_key():
+    return get_random_string(32)
+
+
+class FeedKey(models.Model):
+    class Meta:
+        verbose_name = _("feed key")
+        verbose_name_plural = _("feed keys")
+
+    user = models.OneToOneField(User, primary_key=True,
+                                related_name='feed_key',
+                                verbose_name=_("user"))
+
+    key = models.CharField(max_length=32, default=new_key, editable=False,
+                           verbose_name=_("key"))
+
+    def __str__(self):
+        return "Feed key of {}".format(self.user.username)
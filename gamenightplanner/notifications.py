@@ -0,0 +1,381 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Notifications about changes to events
+
+Signal handlers put small messages on a queue when the transaction commits
+and do not query the database, except for collecting participants of
+deleted events. A background thread drains the queue in batches that collect
+messages for GAMENIGHTPLANNER_NOTIFICATION_DELAY seconds and hands them to a
+pool of worker threads. Workers group the messages by recipient and send one
+digest email to each, so ten RSVPs produce one email to the host.
+
+Notifications are sent only if GAMENIGHTPLANNER_NOTIFICATIONS is set. The
+queue is chosen with GAMENIGHTPLANNER_NOTIFICATION_QUEUE, a dictionary with
+BACKEND and OPTIONS like CACHES.
+"""
+
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mass_mail
+from django.db import close_old_connections, transaction
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
+from django.utils.formats import date_format
+from django.utils.module_loading import import_string
+from django.utils.timezone import localtime
+from django.utils.translation import (override, ugettext as _,
+                                      ugettext_lazy, ungettext)
+from json import dumps, loads
+from logging import getLogger
+from queue import Empty, Queue
+from sqlite3 import connect
+from threading import Lock, Thread, local
+from time import monotonic, sleep
+from .models import events
+
+logger = getLogger(__name__)
+
+_state = local()
+
+Message = namedtuple('Message', 'action event date user recipients')
+Message.__doc__ = """Change to an event
+
+Date is None if it was not known without a query. User is the id of the
+participant who joined or left, recipients is a list of user ids or None if
+they are looked up when sending.
+"""
+
+TEXTS = {
+    'joined': ugettext_lazy("{user} joins the game night on {date}."),
+    'left': ugettext_lazy("{user} left the game night on {date}."),
+    'changed': ugettext_lazy("The game night on {date} was changed."),
+    'cancelled': ugettext_lazy("The game night on {date} was cancelled."),
+    'deleted': ugettext_lazy("The game night on {date} was removed."),
+}
+
+
+# Fields of events whose changes are sent to participants
+CHANGE_FIELDS = ('date', 'length', 'cancelled')
+
+
+def dump_message(message):
+    if message.date is not None:
+        message = message._replace(date=message.date.isoformat())
+    return dumps(message)
+
+
+def load_message(data):
+    message = Message(*loads(data))
+    if message.date is not None:
+        message = message._replace(date=parse_datetime(message.date))
+    return message
+
+
+class BaseQueue:
+    def put(self, message):
+        raise NotImplementedError
+
+    def get(self, timeout):
+        """Returns the next message or None if there is none in timeout"""
+        raise NotImplementedError
+
+    def get_batch(self, max_size, delay, timeout=1.0):
+        """Waits timeout seconds for a message and then collects messages
+        for delay seconds or until there are max_size of them"""
+        message = self.get(timeout)
+        if message is None:
+            return []
+        batch = [message]
+        deadline = monotonic() + delay
+        while len(batch) < max_size:
+            message = self.get(max(deadline - monotonic(), 0))
+            if message is None:
+                break
+            batch.append(message)
+        return batch
+
+
+class MemoryQueue(BaseQueue):
+    """Queue that loses messages when the process exits"""
+    def __init__(self):
+        self.queue = Queue()
+
+    def put(self, message):
+        self.queue.put(message)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+
+class SQLiteQueue(BaseQueue):
+    """Queue stored in an SQLite database file that survives restarts"""
+    poll_interval = 0.1
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS messages ('
+                               'id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+
+    def connect(self):
+        return connect(self.path, timeout=30, isolation_level=None)
+
+    def put(self, message):
+        with self.connect() as connection:
+            connection.execute('INSERT INTO messages (data) VALUES (?)',
+                               (dump_message(message), ))
+
+    def pop(self):
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT id, data FROM messages '
+                                     'ORDER BY id LIMIT 1').fetchone()
+            if row is not None:
+                connection.execute('DELETE FROM messages WHERE id = ?',
+                                   (row[0], ))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return load_message(row[1]) if row is not None else None
+
+    def get(self, timeout):
+        deadline = monotonic() + timeout
+        while True:
+            message = self.pop()
+            if message is not None or monotonic() >= deadline:
+                return message
+            sleep(min(self.poll_interval, max(deadline - monotonic(), 0)))
+
+
+class NotificationWorker:
+    """Drains a queue in a background thread and sends digests in a pool"""
+    batch_size = 1000
+
+    def __init__(self, queue, delay=60, workers=2):
+        self.queue = queue
+        self.delay = delay
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.thread = Thread(target=self.run, daemon=True,
+                             name='gamenightplanner-notifications')
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops after sending what has been queued"""
+        self.running = False
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def get_batch(self, delay, timeout=1.0):
+        """Returns the next batch, or an empty one if reading fails"""
+        try:
+            return self.queue.get_batch(self.batch_size, delay, timeout)
+        except Exception:
+            logger.exception("Reading notifications failed")
+            sleep(timeout)
+            return []
+
+    def run(self):
+        while self.running:
+            batch = self.get_batch(self.delay)
+            if batch:
+                self.pool.submit(self.process, batch)
+        batch = self.get_batch(0, timeout=0)
+        while batch:
+            self.pool.submit(self.process, batch)
+            batch = self.get_batch(0, timeout=0)
+
+    def process(self, batch):
+        try:
+            send_mass_mail(self.get_emails(batch), fail_silently=True)
+        except Exception:
+            logger.exception("Sending %d notifications failed", len(batch))
+        finally:
+            close_old_connections()
+
+    def get_recipients(self, batch):
+        """Returns messages grouped by recipient ids
+
+        Hosts are told about participants and participants about changes,
+        but nobody is told about their own participation. Messages of events
+        that no longer exist are dropped, unless they know their recipients.
+        """
+        lookup = [message.event for message in batch
+                  if message.recipients is None or message.date is None]
+        found = {pk: (host, date) for pk, host, date in
+                 events.Event.objects.filter(pk__in=lookup).values_list(
+                     'pk', 'host_id', 'date')}
+        participants = defaultdict(list)
+        for event, user in events.Event.participants.through.objects.filter(
+                event__in=lookup).values_list('event_id', 'user_id'):
+            participants[event].append(user)
+        recipients = defaultdict(list)
+        for message in batch:
+            if message.recipients is not None:
+                users = message.recipients
+            elif message.event not in found:
+                continue
+            elif message.action in ('joined', 'left'):
+                users = [found[message.event][0]]
+            else:
+                users = participants[message.event]
+            if message.date is None:
+                message = message._replace(date=found[message.event][1])
+            for user in users:
+                if user != message.user:
+                    recipients[user].append(message)
+        return recipients
+
+    def get_emails(self, batch):
+        recipients = self.get_recipients(batch)
+        users = User.objects.in_bulk(
+                set(recipients) | {message.user for message in batch
+                                   if message.user is not None})
+        emails = []
+        for pk, messages in recipients.items():
+            if pk not in users or not users[pk].email:
+                continue
+            with override(self.get_language(users[pk])):
+                emails.append(self.get_email(users[pk], messages, users))
+        return emails
+
+    def get_language(self, user):
+        """Returns the language of emails to user
+
+        Users have no language of their own, so this is LANGUAGE_CODE.
+        """
+        return settings.LANGUAGE_CODE
+
+    def get_email(self, recipient, messages, users):
+        lines = [TEXTS[message.action].format(
+                     user=users[message.user] if message.user in users
+                     else _("Someone"),
+                     date=date_format(localtime(message.date),
+                                      'DATETIME_FORMAT'))
+                 for message in messages]
+        subject = ungettext("%(count)d change in your game nights",
+                            "%(count)d changes in your game nights",
+                            len(lines)) % {'count': len(lines)}
+        return subject, '\n'.join(lines), None, [recipient.email]
+
+
+_worker = None
+
+_worker_lock = Lock()
+
+
+def get_worker():
+    """Returns the worker of this process, starting it if needed"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            config = getattr(settings, 'GAMENIGHTPLANNER_NOTIFICATION_QUEUE',
+                             {})
+            queue = import_string(config.get(
+                    'BACKEND', 'gamenightplanner.notifications.MemoryQueue'))
+            _worker = NotificationWorker(
+                    queue(**config.get('OPTIONS', {})),
+                    getattr(settings, 'GAMENIGHTPLANNER_NOTIFICATION_DELAY',
+                            60),
+                    getattr(settings, 'GAMENIGHTPLANNER_NOTIFICATION_WORKERS',
+                            2))
+            _worker.start()
+        return _worker
+
+
+def stop_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop()
+            _worker = None
+
+
+@contextmanager
+def suppressed():
+    """Sends no notifications about changes made within the block"""
+    previous = getattr(_state, 'suppressed', False)
+    _state.suppressed = True
+    try:
+        yield
+    finally:
+        _state.suppressed = previous
+
+
+def enabled():
+    return (getattr(settings, 'GAMENIGHTPLANNER_NOTIFICATIONS', False) and
+            not getattr(_state, 'suppressed', False))
+
+
+def notify(action, event, date, user=None, recipients=None):
+    if not enabled():
+        return
+    message = Message(action, event, date, user, recipients)
+    transaction.on_commit(lambda: get_worker().queue.put(message))
+
+
+@receiver(m2m_changed, sender=events.Event.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    action = 'joined' if action == 'post_add' else 'left'
+    if not reverse:
+        for user in pk_set:
+            notify(action, instance.pk, instance.date, user)
+    else:
+        # Dates are not known without a query, the worker looks them up
+        for event in pk_set:
+            notify(action, event, None, instance.pk)
+
+
+def is_changed(instance):
+    """Tells if a saved event changed in a way participants should know"""
+    loaded = getattr(instance, '_loaded_values', {})
+    return any(name not in loaded or loaded[name] != getattr(instance, name)
+               for name in CHANGE_FIELDS)
+
+
+@receiver(post_save, sender=events.Event)
+def event_saved(sender, instance, created, **kwargs):
+    if not created:
+        if is_changed(instance):
+            notify('changed', instance.pk, instance.date)
+    elif instance.series_id is not None and instance.cancelled:
+        notify('cancelled', instance.series_id, instance.original_date)
+
+
+@receiver(pre_delete, sender=events.Event)
+def event_deleted(sender, instance, **kwargs):
+    if not enabled():
+        return
+    notify('deleted', instance.pk, instance.date,
+           recipients=list(instance.participants.values_list('pk',
+                                                             flat=True)))
@@ -0,0 +1,128 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Finding start times that suit as many users as possible
+
+Weekly availability windows of users are turned into windows within the
+searched range and merged per user. Each merged window that is long enough
+gives a range of possible start times. Sweeping over the ends of those
+ranges finds every interval in which the same users could attend, so the
+best times are found in O(n log n) time for n windows without building
+per-slot tables.
+"""
+
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+from .dates import aware_datetime, local_date, start_of_day
+from .models.availability import Availability
+
+# Proposed times start at multiples of this in local time
+SLOT = timedelta(minutes=15)
+
+Proposal = namedtuple('Proposal', ['start', 'end', 'users'])
+
+
+def iter_windows(rows, start, end):
+    """Iterates (user id, start, end) windows within [start, end) for weekly
+    (user id, weekday, start time, end time) rows"""
+    weekdays = defaultdict(list)
+    for user_id, weekday, window_start, window_end in rows:
+        weekdays[weekday].append((user_id, window_start, window_end))
+    day, last = local_date(start), local_date(end)
+    while day <= last:
+        for user_id, window_start, window_end in weekdays[day.weekday()]:
+            # Windows starting at times skipped by DST changes start when
+            # clocks have been turned forward
+            first = aware_datetime(datetime.combine(day, window_start))
+            if window_end == time():
+                until = start_of_day(day + timedelta(days=1))
+            else:
+                until = aware_datetime(datetime.combine(day, window_end))
+            first, until = max(first, start), min(until, end)
+            if first < until:
+                yield user_id, first, until
+        day += timedelta(days=1)
+
+
+def merge_windows(windows):
+    """Returns lists of [start, end] of each user with overlapping and
+    adjacent windows merged"""
+    merged = defaultdict(list)
+    for user_id, first, until in sorted(windows):
+        own = merged[user_id]
+        if own and first <= own[-1][1]:
+            own[-1][1] = max(own[-1][1], until)
+        else:
+            own.append([first, until])
+    return merged
+
+
+def align(value, origin):
+    """Rounds value up to the next slot counted from origin"""
+    return origin - (origin - value) // SLOT * SLOT
+
+
+def best_times(rows, start, end, length, limit=5, min_count=1):
+    """Returns at most limit non-overlapping Proposals within [start, end)
+    for availability rows, the ones most users can attend first"""
+    origin = start_of_day(local_date(start))
+    points = []
+    for user_id, own in merge_windows(iter_windows(rows, start,
+                                                   end)).items():
+        for first, until in own:
+            # Possible starts are slots within [first, until - length]
+            first = align(first, origin)
+            last = origin + (until - length - origin) // SLOT * SLOT
+            if first <= last:
+                points.append((first, 1, user_id))
+                points.append((last + SLOT, -1, user_id))
+    points.sort()
+    segments = []
+    users = Counter()
+    for i, (point, change, user_id) in enumerate(points):
+        users[user_id] += change
+        if i + 1 < len(points) and points[i + 1][0] > point:
+            attending = +users
+            if len(attending) >= max(min_count, 1):
+                segments.append((point, points[i + 1][0],
+                                 tuple(sorted(attending))))
+    segments.sort(key=lambda segment: (-len(segment[2]), segment[0]))
+    chosen = []
+    for first, until, attending in segments:
+        candidate = first
+        for proposal in sorted(chosen):
+            if (candidate < proposal.end and
+                    proposal.start < candidate + length):
+                candidate = align(proposal.end, origin)
+        if candidate < until:
+            chosen.append(Proposal(candidate, candidate + length, attending))
+            if len(chosen) >= limit:
+                break
+    chosen.sort(key=lambda proposal: (-len(proposal.users), proposal.start))
+    return chosen
+
+
+def find_best_times(start, end, length, limit=5, min_count=1, users=None):
+    """Returns best times within [start, end) by availabilities of active
+    users, optionally only of the given user ids"""
+    queryset = Availability.objects.filter(user__is_active=True)
+    if users is not None:
+        queryset = queryset.filter(user__in=users)
+    return best_times(queryset.values_list('user_id', 'weekday', 'start',
+                                           'end'),
+                      start, end, length, limit, min_count)
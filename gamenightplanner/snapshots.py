@@ -0,0 +1,201 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Pre-rendered snapshots of calendar pages of the past
+
+Once every event shown on a month, week or day page is archived, the page can
+not change anymore. Fragments of those pages are rendered once into gzip
+compressed files under GAMENIGHTPLANNER_SNAPSHOT_ROOT, named after the path
+of the page, e.g. calendar/2015/5/index.html.gz. Calendar views read them
+instead of querying events and a front proxy may serve them too.
+
+Snapshots are rendered in the default language and time zone, so they are
+used only when those are active. Saving an event or series removes the
+snapshots of the pages that show it or its occurrences.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Min
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http import HttpRequest
+from django.urls import get_script_prefix
+from django.utils import timezone, translation
+from gzip import GzipFile
+from os import makedirs, path, replace, walk
+from os import remove as remove_file
+from shutil import rmtree
+from . import layout
+from .cache import invalidate_archive_end
+from .dates import local_date, start_of_day
+from .models import archive, events
+
+FILE_NAME = 'index.html.gz'
+
+
+def get_root():
+    return getattr(settings, 'GAMENIGHTPLANNER_SNAPSHOT_ROOT', None)
+
+
+def enabled():
+    """Tells whether snapshots are stored and match the active locale"""
+    return (get_root() is not None and
+            translation.get_language() == settings.LANGUAGE_CODE and
+            timezone.get_current_timezone_name() == settings.TIME_ZONE)
+
+
+def get_file(page_path):
+    """Returns the file of the page at page_path, without script prefix"""
+    return path.join(get_root(), *page_path.strip('/').split('/'),
+                     FILE_NAME)
+
+
+def read(page_path):
+    """Returns the fragment of the page at page_path or None"""
+    if not enabled():
+        return None
+    try:
+        with GzipFile(get_file(page_path), 'rb') as snapshot:
+            return snapshot.read().decode('utf-8')
+    except FileNotFoundError:
+        return None
+
+
+def write(page_path, fragment):
+    file_name = get_file(page_path)
+    makedirs(path.dirname(file_name), exist_ok=True)
+    temporary = '{}.tmp'.format(file_name)
+    with open(temporary, 'wb') as raw, GzipFile(fileobj=raw, mode='wb',
+                                                mtime=0) as snapshot:
+        snapshot.write(fragment.encode('utf-8'))
+    # Readers never see partially written snapshots
+    replace(temporary, file_name)
+
+
+def remove(page_paths):
+    for page_path in page_paths:
+        try:
+            remove_file(get_file(page_path))
+        except FileNotFoundError:
+            pass
+
+
+def remove_all():
+    root = get_root()
+    if root is not None and path.isdir(root):
+        for entry in next(walk(root))[1]:
+            rmtree(path.join(root, entry))
+
+
+def page_path(link):
+    return link[len(get_script_prefix()) - 1:]
+
+
+def affected_pages(day):
+    """Returns paths of pages that show given date"""
+    monday, sunday = layout.week_dates(*layout.iso_week(day))
+    return {page_path(layout.day_link(day)),
+            page_path(layout.week_link(*layout.iso_week(day))),
+            page_path(layout.month_link(monday.year, monday.month)),
+            page_path(layout.month_link(sunday.year, sunday.month))}
+
+
+def iter_pages(days):
+    """Iterates (path, view class, period arguments) of pages showing days"""
+    from .views.calendar import CalendarView, DayView, WeekView
+    months, weeks = set(), set()
+    for day in sorted(days):
+        yield (page_path(layout.day_link(day)), DayView,
+               (day.year, day.month, day.day))
+        weeks.add(layout.iso_week(day))
+        monday, sunday = layout.week_dates(*layout.iso_week(day))
+        months.update({(monday.year, monday.month),
+                       (sunday.year, sunday.month)})
+    for week in sorted(weeks):
+        yield page_path(layout.week_link(*week)), WeekView, week
+    for month in sorted(months):
+        yield page_path(layout.month_link(*month)), CalendarView, month
+
+
+def render(page, view_class, period):
+    """Returns the fragment of the page or None if the page may still change
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = page
+    request.user = AnonymousUser()
+    view = view_class(request=request, args=(), kwargs={})
+    view.set_period(*period)
+    start, end = view.get_visible_range()
+    if end > start_of_day(local_date(timezone.now())):
+        return None
+    if view.range_queryset(start, end).exists():
+        return None
+    view.object_list = view.get_queryset()
+    return view.render_fragment(view.get_context_data())
+
+
+def create_snapshots(start, end, rebuild=False):
+    """Renders snapshots of pages showing archived events within [start, end)
+    and returns their number
+
+    Existing snapshots are kept unless rebuild is given.
+    """
+    days = {local_date(event.date) for event in
+            archive.ArchivedEvent.objects.occurrences(start, end)}
+    count = 0
+    with translation.override(settings.LANGUAGE_CODE), \
+            timezone.override(timezone.get_default_timezone()):
+        for page, view_class, period in iter_pages(days):
+            if not rebuild and path.exists(get_file(page)):
+                continue
+            fragment = render(page, view_class, period)
+            if fragment is not None:
+                write(page, fragment)
+                count += 1
+    return count
+
+
+@receiver(archive.events_archived)
+def events_archived(sender, before, moved, **kwargs):
+    if get_root() is not None and moved:
+        # Views must see the new end of the archive
+        invalidate_archive_end()
+        start = archive.ArchivedEvent.objects.aggregate(
+                start=Min('date'))['start']
+        create_snapshots(start, before)
+
+
+@receiver(post_save, sender=events.Event)
+def event_saved(sender, instance, **kwargs):
+    """Removes snapshots of pages that now show the event
+
+    Snapshots exist only for pages without current events, so the pages
+    that showed the event before the change have none.
+    """
+    if get_root() is None:
+        return
+    if instance.recurrence:
+        # Pages before the series and after today have no snapshots to drop
+        days = {local_date(date) for date in instance.occurrence_dates(
+                instance.date, timezone.now())}
+    else:
+        days = {local_date(instance.date)}
+    for day in days:
+        remove(affected_pages(day))
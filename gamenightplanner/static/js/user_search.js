@@ -0,0 +1,73 @@
+/*
+ * Copyright (c) 2017, Tomi Leppänen
+ * This file is part of Game Night Planner
+ *
+ * Game Night Planner is free software: you can redistribute it and/or
+ * modify it under the terms of the Lesser GNU General Public License as
+ * published by the Free Software Foundation, either version 3 of the
+ * License, or (at your option) any later version.
+ *
+ * Game Night Planner is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the Lesser GNU General Public
+ * License along with Game Night Planner.  If not, see
+ * <http://www.gnu.org/licenses/>.
+ */
+
+/* Suggests usernames from the user search API as they are typed */
+(function () {
+    'use strict';
+
+    function search(input) {
+        var url = input.getAttribute('data-search-url');
+        var list = document.getElementById(input.getAttribute('list'));
+        var query = input.value;
+        var request = new XMLHttpRequest();
+        request.open('GET', url + '?limit=10&q=' + encodeURIComponent(query));
+        request.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
+        request.onload = function () {
+            if (request.status !== 200 || input.value !== query) {
+                return;
+            }
+            while (list.firstChild) {
+                list.removeChild(list.firstChild);
+            }
+            JSON.parse(request.responseText).users.forEach(function (user) {
+                var option = document.createElement('option');
+                option.value = user.username;
+                option.setAttribute('data-id', user.id);
+                list.appendChild(option);
+            });
+            choose(input);
+        };
+        request.send();
+    }
+
+    /* Submits the id of the user whose username is typed, if any */
+    function choose(input) {
+        var target = document.getElementById(
+            input.getAttribute('data-target'));
+        var options = document.getElementById(
+            input.getAttribute('list')).options;
+        target.value = '';
+        for (var i = 0; i < options.length; i++) {
+            if (options[i].value === input.value) {
+                target.value = options[i].getAttribute('data-id');
+            }
+        }
+    }
+
+    document.addEventListener('input', function (event) {
+        var input = event.target;
+        if (input.hasAttribute && input.hasAttribute('data-search-url')) {
+            choose(input);
+            clearTimeout(input.searchTimeout);
+            input.searchTimeout = setTimeout(function () {
+                search(input);
+            }, 200);
+        }
+    });
+}());
@@ -1,3 +1,1646 @@
-from django.test import TestCase
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
 
-# Create your tests here.
+
+from collections import deque
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+from django.utils.http import http_date
+from django.utils.six import StringIO
+from django.utils.timezone import localtime, make_aware, now
+from json import loads
+from os import environ
+from random import Random
+from re import search
+from social_core.exceptions import AuthAlreadyAssociated, AuthForbidden
+from social_django.utils import load_strategy
+from sys import stderr
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from time import perf_counter
+from unittest import skipUnless
+from . import layout, snapshots, urls
+from .account import get_feed_token, get_user_by_email, signup
+from .cache import get_archive_end
+from .dates import start_of_day
+from .models import archive, events
+from .models.availability import Availability
+from .notifications import (MemoryQueue, Message, NotificationWorker,
+                            SQLiteQueue, stop_worker)
+from .planning import best_times
+from .views.calendar import CalendarView
+
+
+class LoggedInTestCase(TestCase):
+    """Logs in a test user and starts with an empty cache"""
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'tester@example.com',
+                                             'password')
+        self.client.force_login(self.user)
+        cache.clear()
+
+
+class CalendarQueryTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        # Past ranges look up the end of the archive once
+        get_archive_end()
+
+    def create_events(self, start, count, step=timedelta(days=1)):
+        for i in range(count):
+            event = events.Event.objects.create(
+                    date=make_aware(start + i * step),
+                    length=timedelta(hours=3), host=self.user,
+                    added_by=self.user)
+            event.participants.add(self.user)
+            event.games.create(name="Game {}".format(i))
+
+    def test_month_view_query_count_is_constant(self):
+        url = reverse('calendar:month', args=(2017, 5))
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        self.create_events(datetime(2017, 4, 20, 18), 50)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_month_view_groups_events_by_day(self):
+        self.create_events(datetime(2017, 5, 30, 18), 1)
+        self.create_events(datetime(2017, 6, 3, 23, 30), 1)
+        view = CalendarView()
+        view.year, view.month = 2017, 5
+        days = {}
+        for week_number, week_url, week in view.calendar_iter():
+            for day, day_url, day_events, classes in week:
+                days[day] = day_events
+        self.assertEqual(len(days[datetime(2017, 5, 30).date()]), 1)
+        self.assertEqual(len(days[datetime(2017, 6, 3).date()]), 1)
+        self.assertEqual(len(days[datetime(2017, 6, 4).date()]), 0)
+        self.assertEqual(len(days[datetime(2017, 5, 3).date()]), 0)
+
+    def test_week_and_day_ranges_are_half_open(self):
+        self.create_events(datetime(2017, 5, 7, 23, 59), 1)
+        self.create_events(datetime(2017, 5, 8, 0, 0), 1)
+        response = self.client.get(reverse('calendar:week', args=(2017, 18)))
+        self.assertEqual(len(response.context['events']), 1)
+        response = self.client.get(reverse('calendar:day',
+                                           args=(2017, 5, 8)))
+        self.assertEqual(len(response.context['events']), 1)
+        self.assertEqual(response.context['events'][0].date,
+                         make_aware(datetime(2017, 5, 8)))
+
+    @override_settings(TIME_ZONE='America/Santiago')
+    def test_days_starting_with_dst_change(self):
+        # Clocks were turned from 00:00 to 01:00 on 2022-09-11
+        self.create_events(datetime(2022, 9, 11, 1, 30), 1)
+        response = self.client.get(reverse('calendar:day',
+                                           args=(2022, 9, 10)))
+        self.assertEqual(len(response.context['events']), 0)
+        response = self.client.get(reverse('calendar:day',
+                                           args=(2022, 9, 11)))
+        self.assertEqual(len(response.context['events']), 1)
+        self.assertEqual(start_of_day(date(2022, 9, 11)),
+                         make_aware(datetime(2022, 9, 11, 1)))
+        with timezone.override('America/Havana'):
+            # Clocks were turned from 01:00 to 00:00 on 2022-11-06
+            self.assertEqual(start_of_day(date(2022, 11, 6)),
+                             make_aware(datetime(2022, 11, 6), is_dst=True))
+
+    def test_list_views_query_count_is_constant(self):
+        week_url = reverse('calendar:week', args=(2017, 18))
+        day_url = reverse('calendar:day', args=(2017, 5, 3))
+        self.create_events(datetime(2017, 5, 3, 18), 1)
+        with self.assertNumQueries(5):
+            self.client.get(week_url)
+        with self.assertNumQueries(5):
+            self.client.get(day_url)
+        self.create_events(datetime(2017, 5, 3, 12), 10, timedelta(minutes=5))
+        with self.assertNumQueries(5):
+            response = self.client.get(week_url)
+        self.assertContains(response, "with 1 participants", count=11)
+        with self.assertNumQueries(5):
+            response = self.client.get(day_url)
+        self.assertContains(response, "Game 9")
+
+
+class EventDetailQueryTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 5, 3, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+
+    def test_detail_view_query_count_is_constant(self):
+        url = reverse('events:show', args=(self.event.pk, ))
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertFalse(response.context['participating'])
+        for i in range(10):
+            user = User.objects.create_user('user{}'.format(i))
+            self.event.participants.add(user)
+            self.event.games.create(name="Game {}".format(i))
+        self.event.participants.add(self.user)
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertTrue(response.context['participating'])
+        self.assertTrue(response.context['can_edit'])
+        self.assertContains(response, "user9")
+        self.assertContains(response, "Game 9")
+
+
+class LayoutTestCase(TestCase):
+    def test_month_weeks_use_iso_years(self):
+        month = layout.get_month(2026, 12)
+        self.assertIs(layout.get_month(2026, 12), month)
+        self.assertEqual(len(month.days), 35)
+        self.assertEqual([(week.year, week.week) for week in month.weeks],
+                         [(2026, 49), (2026, 50), (2026, 51), (2026, 52),
+                          (2026, 53)])
+        self.assertEqual(layout.week_dates(2026, 53),
+                         (datetime(2026, 12, 28).date(),
+                          datetime(2027, 1, 3).date()))
+        self.assertEqual(layout.week_link(2026, 54),
+                         reverse('calendar:week', args=(2027, 1)))
+        self.assertEqual(layout.month_link(2026, 13),
+                         reverse('calendar:month', args=(2027, 1)))
+
+    def test_day_view_links_cross_months(self):
+        user = User.objects.create_user('tester', 'tester@example.com')
+        self.client.force_login(user)
+        response = self.client.get(reverse('calendar:day',
+                                           args=(2017, 5, 31)))
+        self.assertEqual(response.context['next_url'],
+                         reverse('calendar:day', args=(2017, 6, 1)))
+
+
+class CalendarCacheTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = events.Event.objects.create(
+                date=make_aware(datetime(2017, 6, 3, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+        self.urls = [reverse('calendar:month', args=(2017, 5)),
+                     reverse('calendar:month', args=(2017, 6)),
+                     reverse('calendar:week', args=(2017, 22)),
+                     reverse('calendar:day', args=(2017, 6, 3))]
+
+    def test_pages_are_cached(self):
+        for url in self.urls:
+            self.client.get(url)
+            with self.assertNumQueries(3):
+                self.client.get(url)
+        response = self.client.get(self.urls[3])
+        self.assertContains(response, "with 0 participants")
+        response = self.client.get(self.urls[3],
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertContains(response, "with 0 participants")
+        self.assertNotContains(response, "Logged in as")
+
+    def test_changes_invalidate_affected_periods(self):
+        for url in self.urls:
+            self.client.get(url)
+        self.event.participants.add(self.user)
+        response = self.client.get(self.urls[3])
+        self.assertContains(response, "with 1 participants")
+        for url in self.urls[:3]:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertGreater(len(queries), 3)
+        other_day = reverse('calendar:day', args=(2017, 6, 10))
+        self.client.get(other_day)
+        self.event.date = make_aware(datetime(2017, 6, 10, 18))
+        self.event.save()
+        response = self.client.get(self.urls[3])
+        self.assertContains(response, "No events for that day!")
+        response = self.client.get(other_day)
+        self.assertContains(response, "with 1 participants")
+
+    def test_game_changes_invalidate_periods(self):
+        self.client.get(self.urls[3])
+        game = self.event.games.create(name="Carcassonne")
+        self.assertContains(self.client.get(self.urls[3]), "Carcassonne")
+        game.delete()
+        self.assertNotContains(self.client.get(self.urls[3]), "Carcassonne")
+
+
+class ConditionalGetTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 3, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+
+    def test_calendar_pages(self):
+        for url in (reverse('calendar:month', args=(2030, 6)),
+                    reverse('calendar:week', args=(2030, 23)),
+                    reverse('calendar:day', args=(2030, 6, 3))):
+            response = self.client.get(url)
+            self.assertFalse(response.has_header('Last-Modified'))
+            etag = response['ETag']
+            with self.assertNumQueries(3):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag,
+                                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.status_code, 200)
+            self.event.participants.add(self.user)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.event.participants.clear()
+
+    def test_deleting_event_changes_calendar_page(self):
+        url = reverse('calendar:day', args=(2030, 6, 3))
+        events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 3, 12)), host=self.user,
+                added_by=self.user)
+        since = http_date()
+        deleted_url = self.event.get_absolute_url()
+        self.event.delete()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, deleted_url)
+
+    def test_event_page(self):
+        url = reverse('events:show', args=(self.event.pk, ))
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.event.games.create(name="Carcassonne")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Carcassonne")
+        response = self.client.get(reverse('events:show', args=(0, )))
+        self.assertEqual(response.status_code, 404)
+
+
+class EventRangeApiTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        # Past ranges look up the end of the archive once
+        get_archive_end()
+        self.other = User.objects.create_user('other')
+        for day in range(1, 6):
+            event = events.Event.objects.create(
+                    date=make_aware(datetime(2017, 6, day, 18)),
+                    length=timedelta(hours=3), host=self.other,
+                    added_by=self.other)
+            event.participants.add(self.other)
+            event.games.create(name="Game {}".format(day))
+        event.participants.add(self.user)
+
+    def get_json(self, **params):
+        response = self.client.get(reverse('api:events'), params)
+        self.assertEqual(response.status_code, 200)
+        return loads(b''.join(response.streaming_content).decode())
+
+    def test_range(self):
+        with self.assertNumQueries(4):
+            data = self.get_json(start='2017-06-02', end='2017-06-05')
+        self.assertEqual([event['games'] for event in data['events']],
+                         [["Game 2"], ["Game 3"], ["Game 4"]])
+        self.assertIsNone(data['next'])
+        data = self.get_json(start='2017-06-05', end='2017-06-06')
+        event = data['events'][0]
+        self.assertEqual(event['host'], {'id': self.other.pk,
+                                         'name': 'other'})
+        self.assertEqual(event['participants'], 2)
+        self.assertTrue(event['participating'])
+        self.assertEqual(event['end'], '2017-06-05T18:00:00Z')
+
+    def test_series(self):
+        series = events.Event.objects.create(
+                date=make_aware(datetime(2017, 5, 1, 19)),
+                length=timedelta(hours=2), host=self.other,
+                added_by=self.other, recurrence='weekly')
+        series.participants.add(self.user)
+        events.Event.objects.create(
+                date=make_aware(datetime(2017, 6, 5, 19)), host=self.other,
+                added_by=self.other, series=series, cancelled=True,
+                original_date=make_aware(datetime(2017, 6, 5, 19)))
+        with self.assertNumQueries(4):
+            data = self.get_json(start='2017-06-05', end='2017-06-13')
+        self.assertEqual([(event['id'], event['start'], event['participating'])
+                          for event in data['events']],
+                         [(series.pk - 1, '2017-06-05T15:00:00Z', True),
+                          (series.pk, '2017-06-12T16:00:00Z', True)])
+        # Only the requested page of a long range is expanded
+        start = make_aware(datetime(2017, 6, 1))
+        end = make_aware(datetime(2117, 6, 1))
+        self.assertEqual(
+                events.Event.objects.occurrences(start, end, 7),
+                events.Event.objects.occurrences(start, end)[:7])
+        data = self.get_json(start='2017-06-01', end='2117-06-01', limit=2,
+                             offset=5)
+        self.assertEqual([event['start'] for event in data['events']],
+                         ['2017-06-12T16:00:00Z', '2017-06-19T16:00:00Z'])
+
+    def test_pagination(self):
+        data = self.get_json(start='2017-06-01', end='2017-07-01', limit=2)
+        ids = [event['id'] for event in data['events']]
+        while data['next'] is not None:
+            response = self.client.get(data['next'])
+            data = loads(b''.join(response.streaming_content).decode())
+            ids.extend(event['id'] for event in data['events'])
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_invalid_parameters(self):
+        url = reverse('api:events')
+        response = self.client.get(url, {'start': '2017-06-01'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'start': '2017-06-01',
+                                         'end': '2017-07-01', 'limit': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'start': '2017-02-30',
+                                         'end': '2017-07-01'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'start': '2017-06-01',
+                                         'end': '2017-07-01T25:00'})
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        response = self.client.get(url, {'start': '2017-06-01',
+                                         'end': '2017-07-01'})
+        self.assertEqual(response.status_code, 403)
+
+
+class SignupPipelineTestCase(TestCase):
+    class Backend:
+        name = 'test'
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'Tester@Example.com')
+        self.request = RequestFactory().get('/')
+        self.request.session = self.client.session
+        self.strategy = load_strategy(self.request)
+
+    def run_signup(self, **kwargs):
+        return signup(strategy=self.strategy, backend=self.Backend(),
+                      pipeline_index=0, **kwargs)
+
+    def test_login(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.run_signup(user=self.user, is_new=False),
+                             {})
+        with self.assertRaises(AuthForbidden):
+            self.run_signup(is_new=True)
+
+    def test_signup(self):
+        self.request.session['account_verified_email'] = 'new@example.com'
+        response = self.run_signup(is_new=True)
+        self.assertEqual(response.status_code, 302)
+        token = self.request.session['partial_pipeline_token']
+        self.assertEqual(response.url,
+                         reverse('account:signup-form', args=(token, )))
+        self.request.session['account_verified_email'] = 'tester@example.com'
+        with self.assertRaises(AuthAlreadyAssociated):
+            self.run_signup(user=self.user, is_new=False)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.run_signup(is_new=True),
+                             {'user': self.user})
+        self.assertNotIn('account_verified_email', self.request.session)
+
+    def test_emails_are_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user('other', 'tester@EXAMPLE.com')
+        User.objects.create_user('first')
+        User.objects.create_user('second')
+
+    @skipUnless(connection.vendor == 'sqlite', "Query plan is SQLite's")
+    def test_email_lookup_uses_index(self):
+        User.objects.create_user('blank')
+        self.assertIsNone(get_user_by_email(''))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(get_user_by_email('TESTER@example.COM'),
+                             self.user)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql'])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('USING INDEX gamenightplanner_user_email_lower', plan)
+
+    def test_signup_form(self):
+        session = self.client.session
+        session['account_verified_email'] = 'new@example.com'
+        session.save()
+        url = reverse('account:signup-form', args=('token', ))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'new@example.com')
+        session['account_verified_email'] = 'TESTER@example.com'
+        session.save()
+        response = self.client.post(url, {'username': 'new'})
+        self.assertContains(response, "Email is already registered")
+
+
+class UserSearchTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.bulk_create([User(username='user{:02}'.format(i))
+                                  for i in range(30)])
+        User.objects.filter(username='user00').update(is_active=False)
+
+    def test_search_pages(self):
+        url = reverse('api:users')
+        data = loads(self.client.get(url, {'q': 'user', 'limit': 20})
+                     .content.decode())
+        self.assertEqual(len(data['users']), 20)
+        self.assertEqual(data['users'][0]['username'], 'user01')
+        data = loads(self.client.get(data['next']).content.decode())
+        self.assertEqual([user['username'] for user in data['users']],
+                         ['user{}'.format(i) for i in range(21, 30)])
+        self.assertIsNone(data['next'])
+
+    def test_forms_do_not_list_users(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('events:add'))
+        self.assertContains(response, 'value="tester"')
+        self.assertNotContains(response, 'user01')
+        event = events.Event.objects.create(
+                date=now() + timedelta(days=1), host=self.user,
+                added_by=self.user)
+        response = self.client.get(reverse('events:edit', args=(event.pk, )))
+        self.assertContains(response, 'value="tester"')
+        self.assertNotContains(response, 'user01')
+        data = {'date': localtime(event.date).strftime('%Y-%m-%d %H:%M:%S'),
+                'recurrence': '', 'host': User.objects.get(
+                    username='user00').pk}
+        response = self.client.post(
+                reverse('events:edit', args=(event.pk, )), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['form'].is_valid())
+
+
+class GameTitleTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = []
+        for i, name in enumerate(["Catan", " catan", "Settlers of Catan",
+                                  "Carcassonne"]):
+            event = events.Event.objects.create(
+                    date=make_aware(datetime(2030, 6, i + 1, 18)),
+                    host=self.user, added_by=self.user)
+            event.games.create(name=name)
+            self.events.append(event)
+
+    def test_titles_are_deduplicated(self):
+        self.assertEqual(events.GameTitle.objects.count(), 3)
+        self.assertEqual(list(events.Event.objects.playing("CATAN ")),
+                         self.events[:2])
+        game = self.events[0].games.get()
+        game.name = "Carcassonne"
+        game.save()
+        self.assertEqual(list(events.Event.objects.playing("carcassonne")),
+                         [self.events[0], self.events[3]])
+
+    def test_autocomplete(self):
+        url = reverse('api:games')
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'q': 'CA'})
+        self.assertEqual(loads(response.content.decode())['titles'],
+                         ["Carcassonne", "Catan"])
+        response = self.client.get(url, {'q': 'ca', 'limit': 1})
+        self.assertEqual(loads(response.content.decode())['titles'],
+                         ["Carcassonne"])
+        response = self.client.get(url, {'q': 'ca', 'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class EventFeedTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'tester@example.com',
+                                             'password')
+        self.other = User.objects.create_user('other')
+        for day in range(1, 5):
+            event = events.Event.objects.create(
+                    date=make_aware(datetime(2017, 6, day, 18)),
+                    length=timedelta(hours=3), host=self.other,
+                    added_by=self.other)
+            event.games.create(name="Game {}".format(day))
+            event.games.create(name="Extra; game, {}".format(day))
+            event.participants.add(self.other)
+        event.participants.add(self.user)
+        self.event = event
+        token = get_feed_token(self.user)
+        self.url = reverse('feeds:all', args=(token, ))
+        self.personal_url = reverse('feeds:personal', args=(token, ))
+
+    def get_feed(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_feeds(self):
+        with self.assertNumQueries(5):
+            feed = self.get_feed(self.url)
+        self.assertEqual(feed.count('BEGIN:VEVENT'), 4)
+        self.assertIn('SUMMARY:Game 2\\, Extra\\; game\\, 2 hosted by other',
+                      feed)
+        self.assertIn('DTSTART;TZID=Europe/Helsinki:20170602T180000\r\n',
+                      feed)
+        self.assertIn('Participants: other\\, tester', feed)
+        feed = self.get_feed(self.personal_url)
+        self.assertEqual(feed.count('BEGIN:VEVENT'), 1)
+        self.assertIn('UID:event-{}@'.format(self.event.pk), feed)
+        for line in feed.split('\r\n'):
+            self.assertLessEqual(len(line.encode()), 75)
+
+    def test_etag(self):
+        response = self.client.get(self.personal_url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(self.personal_url,
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.event.participants.remove(self.user)
+        response = self.client.get(self.personal_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_revoking_urls(self):
+        self.client.force_login(self.user)
+        # Caches the old token
+        self.client.get(reverse('main'))
+        response = self.client.post(reverse('account:reset-feeds'))
+        self.assertRedirects(response, reverse('main'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(self.personal_url).status_code, 404)
+        response = self.client.get(reverse('main'))
+        self.assertContains(response, reverse(
+                'feeds:all', args=(get_feed_token(self.user), )))
+        self.get_feed(reverse('feeds:all',
+                              args=(get_feed_token(self.user), )))
+
+    def test_personal_feed_contains_exceptions(self):
+        series = events.Event.objects.create(
+                date=make_aware(datetime(2017, 6, 5, 18)), host=self.other,
+                added_by=self.other, recurrence='weekly')
+        series.participants.add(self.user)
+        etag = self.client.get(self.personal_url)['ETag']
+        events.Event.objects.create(
+                date=make_aware(datetime(2017, 6, 12, 18)), host=self.other,
+                added_by=self.other, series=series, cancelled=True,
+                original_date=make_aware(datetime(2017, 6, 12, 18)))
+        response = self.client.get(self.personal_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        feed = b''.join(response.streaming_content).decode()
+        self.assertEqual(feed.count('BEGIN:VEVENT'), 3)
+        self.assertIn('RECURRENCE-ID;TZID=Europe/Helsinki:20170612T180000\r\n'
+                      'STATUS:CANCELLED\r\n', feed)
+
+    def test_main_page_links_feeds(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('main'))
+        self.assertContains(response, self.personal_url)
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('feeds:all', args=('invalid', )))
+        self.assertEqual(response.status_code, 404)
+
+
+class ParticipationApiTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.events = [events.Event.objects.create(
+                date=make_aware(datetime(year, 6, 1, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+                for year in (2017, 2030, 2031, 2032)]
+        self.url = reverse('api:participation')
+
+    def test_join_and_leave_by_ids(self):
+        ids = [event.pk for event in self.events]
+        response = self.client.post(self.url, {'action': 'join',
+                                               'event': ids})
+        self.assertEqual(loads(response.content.decode())['events'], ids[1:])
+        self.assertEqual(set(self.user.events.values_list('pk', flat=True)),
+                         set(ids[1:]))
+        response = self.client.post(self.url, {'action': 'join',
+                                               'event': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.user.events.count(), 3)
+        response = self.client.post(self.url, {'action': 'leave',
+                                               'event': ids[2:]})
+        self.assertEqual(loads(response.content.decode())['events'], ids[2:])
+        self.assertEqual(list(self.user.events.values_list('pk', flat=True)),
+                         [ids[1]])
+
+    def test_join_by_range(self):
+        with self.assertNumQueries(10):
+            self.client.post(self.url, {'action': 'join',
+                                        'start': '2000-01-01',
+                                        'end': '2031-12-31'})
+        self.assertEqual(self.user.events.count(), 2)
+        self.events[1].refresh_from_db()
+        self.assertEqual(self.events[1].participant_count, 1)
+
+    def test_join_series_by_range(self):
+        series = events.Event.objects.create(
+                date=make_aware(datetime(2030, 1, 7, 18)), host=self.user,
+                added_by=self.user, recurrence='weekly')
+        moved = events.Event.objects.create(
+                date=make_aware(datetime(2030, 7, 2, 18)), host=self.user,
+                added_by=self.user, series=series,
+                original_date=make_aware(datetime(2030, 6, 3, 18)))
+        response = self.client.post(self.url, {'action': 'join',
+                                               'start': '2030-06-01',
+                                               'end': '2030-06-30'})
+        self.assertEqual(loads(response.content.decode())['events'],
+                         [self.events[1].pk, series.pk])
+        self.assertNotIn(self.user, moved.participants.all())
+
+    def test_invalid_requests(self):
+        response = self.client.post(self.url, {'action': 'maybe',
+                                               'event': [1]})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {'action': 'join'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {'action': 'join',
+                                               'event': ['x']})
+        self.assertEqual(response.status_code, 400)
+
+
+class EventCounterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'tester@example.com',
+                                             'password')
+        self.others = [User.objects.create_user('user{}'.format(i))
+                       for i in range(3)]
+        self.event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 1, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+
+    def assertCounts(self, participants, games):
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.participant_count, self.event.game_count),
+                         (participants, games))
+
+    def test_participants(self):
+        self.event.participants.add(*self.others)
+        self.event.participants.add(self.others[0])
+        self.assertCounts(3, 0)
+        self.event.participants.remove(self.others[0], self.user)
+        self.assertCounts(2, 0)
+        self.others[1].events.clear()
+        self.assertCounts(1, 0)
+        self.user.events.add(self.event)
+        self.others[2].events.remove(self.event)
+        self.assertCounts(1, 0)
+        self.event.participants.clear()
+        self.assertCounts(0, 0)
+
+    def test_games(self):
+        game = self.event.games.create(name="Game")
+        self.event.games.create(name="Other game")
+        game.name = "Renamed"
+        game.save()
+        self.assertCounts(0, 2)
+        game.delete()
+        self.assertCounts(0, 1)
+
+    def test_save_keeps_counters(self):
+        stale = events.Event.objects.get(pk=self.event.pk)
+        self.event.participants.add(self.user)
+        stale.length = timedelta(hours=4)
+        stale.save()
+        self.assertCounts(1, 0)
+
+    def test_command_fixes_drift(self):
+        self.event.participants.add(self.user)
+        self.event.games.create(name="Game")
+        events.Event.objects.update(participant_count=5, game_count=0)
+        output = StringIO()
+        call_command('update_event_counters', dry_run=True, stdout=output)
+        self.assertIn("Found 1 events", output.getvalue())
+        self.assertCounts(5, 0)
+        call_command('update_event_counters', stdout=output)
+        self.assertCounts(1, 1)
+
+
+class TransferTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'tester@example.com',
+                                             'password')
+        self.other = User.objects.create_user('other', 'Other@example.com')
+        self.series = events.Event.objects.create(
+                date=make_aware(datetime(2030, 3, 6, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user,
+                recurrence='weekly', recurrence_count=5)
+        self.series.participants.add(self.user, self.other)
+        self.series.games.create(name="Game, with comma")
+        self.series.games.create(name="Other game")
+        events.Event.objects.create(
+                date=make_aware(datetime(2030, 3, 14, 18)), length=None,
+                host=self.other, added_by=self.user, series=self.series,
+                original_date=self.series.date + timedelta(days=7))
+
+    def get_state(self):
+        return [(event.date, event.length, event.host_id, event.recurrence,
+                 event.recurrence_end, event.series_id is not None,
+                 event.participant_count, event.game_count,
+                 sorted(event.games.values_list('name', flat=True)),
+                 sorted(event.participants.values_list('pk', flat=True)))
+                for event in events.Event.objects.order_by('pk')]
+
+    def roundtrip(self, format):
+        state = self.get_state()
+        output = StringIO()
+        with self.assertNumQueries(3):
+            call_command('export_events', format=format, stdout=output)
+        events.Event.objects.all().delete()
+        with NamedTemporaryFile('w', encoding='utf-8', newline='',
+                                suffix='.' + format) as dump:
+            dump.write(output.getvalue())
+            dump.flush()
+            call_command('import_events', dump.name, format=format,
+                         batch_size=1, stdout=StringIO())
+        self.assertEqual(self.get_state(), state)
+
+    def test_ndjson(self):
+        self.roundtrip('ndjson')
+
+    def test_csv(self):
+        self.roundtrip('csv')
+
+    def test_users_by_email(self):
+        output = StringIO()
+        call_command('export_events', stdout=output)
+        dump = output.getvalue().replace('"other"', '"other@EXAMPLE.com"')
+        with NamedTemporaryFile('w', encoding='utf-8') as dump_file:
+            dump_file.write(dump)
+            dump_file.flush()
+            call_command('import_events', dump_file.name, stdout=StringIO())
+            self.assertEqual(self.other.hosted_events.count(), 2)
+            dump_file.write(dump.replace('"tester"', '"nobody"'))
+            dump_file.flush()
+            with self.assertRaises(CommandError):
+                call_command('import_events', dump_file.name,
+                             stdout=StringIO())
+        self.assertEqual(events.Event.objects.count(), 4)
+
+    def test_ids_follow_archive(self):
+        old = events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 5, 18)), length=None,
+                host=self.user, added_by=self.user)
+        call_command('archive_events', months=1, stdout=StringIO())
+        output = StringIO()
+        call_command('export_events', stdout=output)
+        events.Event.objects.all().delete()
+        with NamedTemporaryFile('w', encoding='utf-8') as dump:
+            dump.write(output.getvalue())
+            dump.flush()
+            call_command('import_events', dump.name, stdout=StringIO())
+        self.assertGreater(
+                events.Event.objects.order_by('pk').first().pk, old.pk)
+
+
+class UpcomingEventsTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other')
+        # Feed key is created on the first visit
+        get_feed_token(self.user)
+        start = now().replace(microsecond=0) + timedelta(days=1)
+        self.hosted, self.joined, self.foreign = [
+                events.Event.objects.create(
+                    date=start + timedelta(days=i), length=timedelta(hours=3),
+                    host=host, added_by=host)
+                for i, host in enumerate((self.user, self.other, self.other))]
+        self.joined.participants.add(self.user)
+
+    def get_upcoming(self, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('main'))
+        return [event.pk for event in response.context['upcoming_events']]
+
+    def test_hosted_and_joined(self):
+        self.assertEqual(self.get_upcoming(4),
+                         [self.hosted.pk, self.joined.pk])
+        self.assertEqual(self.get_upcoming(2),
+                         [self.hosted.pk, self.joined.pk])
+        # Events of other users do not concern the user
+        self.foreign.date += timedelta(hours=1)
+        self.foreign.save()
+        self.assertEqual(self.get_upcoming(2),
+                         [self.hosted.pk, self.joined.pk])
+        self.user.events.add(self.foreign)
+        self.assertEqual(self.get_upcoming(4), [self.hosted.pk,
+                                                self.joined.pk,
+                                                self.foreign.pk])
+        self.foreign.participants.remove(self.user)
+        self.hosted.date -= timedelta(days=2)
+        self.hosted.save()
+        self.assertEqual(self.get_upcoming(4), [self.joined.pk])
+
+    def test_series(self):
+        self.joined.recurrence = 'weekly'
+        self.joined.save()
+        events.Event.objects.create(
+                date=self.joined.date, host=self.other, added_by=self.other,
+                series=self.joined, original_date=self.joined.date,
+                cancelled=True)
+        found = self.client.get(reverse('main')).context['upcoming_events']
+        self.assertEqual([(event.pk, event.date) for event in found],
+                         [(self.hosted.pk, self.hosted.date)] +
+                         [(self.joined.pk, self.joined.nth_occurrence(i))
+                          for i in range(1, 9)])
+
+
+class ConflictTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other')
+        self.start = now().replace(microsecond=0) + timedelta(days=1)
+        self.event = self.create_event(self.start, self.user)
+
+    def create_event(self, date, host, **kwargs):
+        return events.Event.objects.create(
+                date=date, length=timedelta(hours=3), host=host,
+                added_by=host, **kwargs)
+
+    def test_overlapping(self):
+        long_ago = self.create_event(self.start - timedelta(days=400),
+                                     self.user)
+        touching = self.create_event(self.start + timedelta(hours=3),
+                                     self.user)
+        series = self.create_event(self.start - timedelta(days=7, hours=1),
+                                   self.other, recurrence='weekly')
+        found = events.Event.objects.overlapping(
+                self.start, self.start + timedelta(hours=3))
+        self.assertEqual([(event.pk, event.date) for event in found],
+                         [(series.pk, self.start - timedelta(hours=1)),
+                          (self.event.pk, self.start)])
+        self.assertNotIn(long_ago, found)
+        self.assertNotIn(touching, found)
+        events.Event.objects.create(
+                date=self.start, host=self.other, added_by=self.other,
+                series=series, original_date=self.start - timedelta(hours=1),
+                cancelled=True)
+        self.assertEqual(events.Event.objects.overlapping(
+                self.start, self.start + timedelta(hours=3)), [self.event])
+
+    def test_create_and_edit(self):
+        data = {'date': localtime(self.start + timedelta(hours=1)).strftime(
+                        '%Y-%m-%d %H:%M:%S'),
+                'length': '02:00:00', 'host': self.user.pk, 'recurrence': '',
+                'games-TOTAL_FORMS': 0, 'games-INITIAL_FORMS': 0}
+        response = self.client.post(reverse('events:add'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "has other events at the same time")
+        data['host'] = self.other.pk
+        self.client.post(reverse('events:add'), data)
+        self.assertEqual(self.other.hosted_events.count(), 1)
+        del data['games-TOTAL_FORMS'], data['games-INITIAL_FORMS']
+        data['host'] = self.user.pk
+        response = self.client.post(
+                reverse('events:edit', args=(self.event.pk, )), data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_join(self):
+        other_event = self.create_event(self.start + timedelta(hours=2),
+                                        self.other)
+        response = self.client.get(
+                reverse('events:participate', args=(other_event.pk, )),
+                follow=True)
+        self.assertContains(response, "overlaps with your other events")
+        response = self.client.post(reverse('api:participation'),
+                                    {'action': 'join',
+                                     'event': [other_event.pk]})
+        self.assertEqual(loads(response.content.decode())['conflicts'],
+                         [[other_event.pk, self.event.pk]])
+
+
+class ArchiveTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 5, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+        self.old.participants.add(self.user)
+        self.old.games.create(name="Old game")
+        self.series = events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 1, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user,
+                recurrence='weekly', recurrence_count=4)
+        events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 9, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user,
+                series=self.series,
+                original_date=make_aware(datetime(2015, 5, 8, 18)))
+        self.current = events.Event.objects.create(
+                date=now() + timedelta(days=1), length=timedelta(hours=3),
+                host=self.user, added_by=self.user)
+        self.month_url = reverse('calendar:month', args=(2015, 5))
+
+    def test_querysets(self):
+        self.assertEqual(list(events.Event.objects.upcoming()),
+                         [self.current])
+        self.assertEqual(set(events.Event.objects.archived()),
+                         set(events.Event.objects.exclude(
+                             pk=self.current.pk)))
+
+    def test_archive_command(self):
+        before = self.client.get(self.month_url)
+        call_command('archive_events', months=1, stdout=StringIO())
+        self.assertEqual(list(events.Event.objects.all()), [self.current])
+        self.assertEqual(archive.ArchivedEvent.objects.count(), 3)
+        archived = archive.ArchivedEvent.objects.get(pk=self.old.pk)
+        self.assertEqual(list(archived.games.values_list('name', flat=True)),
+                         ["Old game"])
+        self.assertEqual(list(archived.participants.all()), [self.user])
+        after = self.client.get(self.month_url)
+        self.assertEqual(
+                [(day, [(event.pk, event.date) for event in day_events])
+                 for week in before.context['view'].calendar_iter()
+                 for day, day_link, day_events, classes in week[2]],
+                [(day, [(event.pk, event.date) for event in day_events])
+                 for week in after.context['view'].calendar_iter()
+                 for day, day_link, day_events, classes in week[2]])
+        response = self.client.get(reverse('events:show',
+                                           args=(self.old.pk, )))
+        self.assertContains(response, "Old game")
+        self.assertFalse(response.context['can_edit'])
+
+    def test_api_and_feeds_read_archive(self):
+        api_url = '{}?start=2015-05-01&end=2015-06-01'.format(
+                reverse('api:events'))
+        token = get_feed_token(self.user)
+        feed_urls = [reverse('feeds:all', args=(token, )),
+                     reverse('feeds:personal', args=(token, ))]
+        urls = [api_url] + feed_urls
+        before = [b''.join(self.client.get(url).streaming_content)
+                  for url in urls]
+        call_command('archive_events', months=1, stdout=StringIO())
+        after = [b''.join(self.client.get(url).streaming_content)
+                 for url in urls]
+        self.assertEqual(after, before)
+        self.assertEqual(loads(after[0].decode())['events'][1]['games'],
+                         ["Old game"])
+        response = self.client.get(reverse('events:show',
+                                           args=(self.old.pk, )))
+        self.assertIn('ETag', response)
+
+    def test_future_ranges_skip_archive(self):
+        call_command('archive_events', months=1, stdout=StringIO())
+        url = reverse('calendar:week', args=(now().year + 1, 10))
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+
+class SnapshotTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = TemporaryDirectory()
+        self.settings = override_settings(
+                GAMENIGHTPLANNER_SNAPSHOT_ROOT=self.root.name)
+        self.settings.enable()
+        self.old = events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 5, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user)
+        self.old.games.create(name="Old game")
+        self.month_url = reverse('calendar:month', args=(2015, 5))
+        self.day_url = reverse('calendar:day', args=(2015, 5, 5))
+
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+
+    def test_archived_pages_are_snapshotted(self):
+        before = self.client.get(self.day_url).context['fragment']
+        call_command('archive_events', months=1, stdout=StringIO())
+        with self.assertNumQueries(2):
+            response = self.client.get(self.day_url,
+                                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.content.decode(), before)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.month_url)
+        self.assertContains(response, 'has_event')
+        new = events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 12, 12)), host=self.user,
+                added_by=self.user)
+        self.assertIsNone(snapshots.read(self.month_url))
+        self.assertIsNotNone(snapshots.read(self.day_url))
+        self.assertContains(self.client.get(self.month_url), 'has_event',
+                            count=2)
+        self.assertIn(new, self.client.get(reverse(
+            'calendar:day', args=(2015, 5, 12))).context['events'])
+
+    def test_series_removes_pages_of_its_occurrences(self):
+        call_command('archive_events', months=1, stdout=StringIO())
+        self.assertIsNotNone(snapshots.read(self.month_url))
+        events.Event.objects.create(
+                date=make_aware(datetime(2015, 5, 26, 18)), host=self.user,
+                added_by=self.user, recurrence='weekly',
+                recurrence_count=2)
+        self.assertIsNotNone(snapshots.read(self.day_url))
+        self.assertIsNone(snapshots.read(self.month_url))
+
+    def test_command(self):
+        call_command('archive_events', months=1, stdout=StringIO())
+        output = StringIO()
+        call_command('snapshot_calendar', stdout=output)
+        self.assertEqual(output.getvalue(), "Rendered 0 snapshots\n")
+        call_command('snapshot_calendar', rebuild=True, stdout=output)
+        self.assertIn("Rendered 3 snapshots", output.getvalue())
+        call_command('snapshot_calendar', clear=True, stdout=StringIO())
+        self.assertGreater(len(self.client.get(self.day_url).context[
+            'events']), 0)
+
+
+class PlanningTestCase(LoggedInTestCase):
+    ROWS = [(1, 0, time(18), time(22)), (2, 0, time(19), time(23)),
+            (3, 1, time(18), time(21)), (3, 3, time(20), time())]
+
+    def setUp(self):
+        super().setUp()
+        self.start = make_aware(datetime(2030, 6, 3))
+
+    def at(self, day, hour, minute=0):
+        return make_aware(datetime(2030, 6, day, hour, minute))
+
+    def test_best_times(self):
+        proposals = best_times(self.ROWS, self.start,
+                               self.start + timedelta(days=7),
+                               timedelta(hours=2), limit=4)
+        self.assertEqual([(proposal.start, proposal.users)
+                          for proposal in proposals],
+                         [(self.at(3, 19), (1, 2)), (self.at(3, 21), (2, )),
+                          (self.at(4, 18), (3, )), (self.at(6, 20), (3, ))])
+        proposals = best_times(self.ROWS, self.start,
+                               self.start + timedelta(days=7),
+                               timedelta(minutes=50), min_count=2)
+        self.assertEqual([(proposal.start, proposal.end)
+                          for proposal in proposals],
+                         [(self.at(3, 19), self.at(3, 19, 50))])
+
+    def test_api_feeds_event_form(self):
+        other = User.objects.create_user('other')
+        for user_id, weekday, start, end in self.ROWS[:2]:
+            Availability.objects.create(
+                    user=[self.user, other][user_id - 1], weekday=weekday,
+                    start=start, end=end)
+        response = self.client.get(reverse('api:best-times'), {
+                'start': '2030-06-03', 'end': '2030-06-10', 'length': 120,
+                'min': 2})
+        times = loads(response.content.decode())['times']
+        self.assertEqual([[user['name'] for user in proposal['users']]
+                          for proposal in times], [['tester', 'other']])
+        response = self.client.get(times[0]['url'])
+        self.assertEqual(response.context['form'].initial['date'],
+                         datetime(2030, 6, 3, 19))
+        self.assertEqual(response.context['form'].initial['length'],
+                         timedelta(hours=2))
+
+    def test_daylight_saving_time_changes(self):
+        Availability.objects.create(user=self.user, weekday=6,
+                                    start=time(3, 30), end=time(6))
+        response = self.client.get(reverse('api:best-times'), {
+                'start': '2030-03-25', 'end': '2030-04-01', 'length': 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([proposal['start'] for proposal in loads(
+                response.content.decode())['times']],
+                         ['2030-03-31T01:30:00Z'])
+        response = self.client.get(reverse('api:best-times'), {
+                'start': '2030-10-21', 'end': '2030-10-28', 'length': 60})
+        self.assertEqual(response.status_code, 200)
+
+    def test_availability_form(self):
+        data = {'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 0,
+                'form-0-weekday': 4, 'form-0-start': '18:00',
+                'form-0-end': '17:00'}
+        url = reverse('account:availability')
+        response = self.client.post(url, data)
+        self.assertContains(response, "availability must end after it")
+        data['form-0-end'] = '00:00'
+        self.assertRedirects(self.client.post(url, data), url)
+        self.assertEqual(str(self.user.availabilities.get()),
+                         "Friday 18:00-00:00")
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host', 'host@example.com')
+        self.users = [User.objects.create_user(
+                'user{}'.format(i), 'user{}@example.com'.format(i))
+                for i in range(10)]
+        self.event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 1, 18)),
+                length=timedelta(hours=3), host=self.host,
+                added_by=self.host)
+
+    def test_queues(self):
+        message = Message('joined', 1, make_aware(datetime(2030, 6, 1, 18)),
+                          2, None)
+        with NamedTemporaryFile(suffix='.sqlite3') as path:
+            for queue in (MemoryQueue(), SQLiteQueue(path.name)):
+                self.assertEqual(queue.get_batch(10, 0, timeout=0), [])
+                for i in range(3):
+                    queue.put(message._replace(event=i))
+                batch = queue.get_batch(2, 0.01)
+                self.assertEqual(batch, [message._replace(event=0),
+                                         message._replace(event=1)])
+                self.assertEqual(len(queue.get_batch(10, 0.01)), 1)
+
+    def test_digest(self):
+        batch = [Message('joined', self.event.pk, self.event.date, user.pk,
+                         None) for user in self.users[1:]]
+        batch += [Message('joined', self.event.pk, None, self.users[0].pk,
+                          None),
+                  Message('left', self.event.pk + 1, None, self.users[0].pk,
+                          None),
+                  Message('changed', self.event.pk, self.event.date,
+                          None, None)]
+        self.event.participants.add(self.users[0])
+        with self.assertNumQueries(3):
+            emails = NotificationWorker(MemoryQueue()).get_emails(batch)
+        emails.sort(key=lambda email: email[3])
+        self.assertEqual([email[3] for email in emails],
+                         [['host@example.com'], ['user0@example.com']])
+        self.assertEqual(emails[0][0], "10 changes in your game nights")
+        self.assertIn("user9 joins the game night on", emails[0][1])
+        self.assertEqual(emails[1][0], "1 change in your game nights")
+
+    @override_settings(USE_L10N=True)
+    def test_digest_language(self):
+        class FinnishWorker(NotificationWorker):
+            def get_language(self, user):
+                return 'fi'
+
+        batch = [Message('changed', self.event.pk, self.event.date, None,
+                         [self.host.pk])]
+        with translation.override('fi'):
+            emails = NotificationWorker(MemoryQueue()).get_emails(batch)
+        self.assertIn("on June 1, 2030, 6 p.m.", emails[0][1])
+        emails = FinnishWorker(MemoryQueue()).get_emails(batch)
+        self.assertIn("1. kesäkuuta 2030 kello 18.00", emails[0][1])
+
+
+@override_settings(GAMENIGHTPLANNER_NOTIFICATIONS=True,
+                   GAMENIGHTPLANNER_NOTIFICATION_DELAY=0.05)
+class NotificationWorkerTestCase(TransactionTestCase):
+    def tearDown(self):
+        stop_worker()
+
+    def test_rsvps_are_digested(self):
+        host = User.objects.create_user('host', 'host@example.com')
+        event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 1, 18)),
+                length=timedelta(hours=3), host=host, added_by=host)
+        for i in range(10):
+            event.participants.add(User.objects.create_user(
+                    'user{}'.format(i), 'user{}@example.com'.format(i)))
+        stop_worker()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['host@example.com'])
+        self.assertEqual(len(mail.outbox[0].body.splitlines()), 10)
+
+    def test_only_visible_changes_are_sent(self):
+        host = User.objects.create_user('host', 'host@example.com')
+        user = User.objects.create_user('user', 'user@example.com')
+        event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 1, 18)),
+                length=timedelta(hours=3), host=host, added_by=host)
+        event.participants.add(user)
+        event = events.Event.objects.get(pk=event.pk)
+        event.added = now()
+        event.save()
+        event.length = timedelta(hours=4)
+        event.save()
+        event.save()
+        stop_worker()
+        bodies = [message.body for message in mail.outbox
+                  if message.to == ['user@example.com']]
+        self.assertEqual(len(bodies), 1)
+        self.assertEqual(len(bodies[0].splitlines()), 1)
+
+    def test_queue_errors_are_logged(self):
+        class FailingQueue(MemoryQueue):
+            failed = False
+
+            def get_batch(self, max_size, delay, timeout=1.0):
+                if not self.failed:
+                    self.failed = True
+                    raise OSError("Queue is unavailable")
+                return super().get_batch(max_size, delay, timeout)
+
+        host = User.objects.create_user('host', 'host@example.com')
+        event = events.Event.objects.create(
+                date=make_aware(datetime(2030, 6, 1, 18)),
+                length=timedelta(hours=3), host=host, added_by=host)
+        worker = NotificationWorker(FailingQueue(), delay=0)
+        with self.assertLogs('gamenightplanner.notifications') as logs:
+            worker.start()
+            worker.queue.put(Message('joined', event.pk, event.date,
+                                     None, None))
+            worker.stop()
+        self.assertIn("Reading notifications failed", logs.output[0])
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class LoadTestCommandTestCase(TransactionTestCase):
+    def test_pages_are_requested_concurrently(self):
+        user = User.objects.create_user('tester', 'tester@example.com')
+        event = events.Event.objects.create(
+                date=now() + timedelta(days=1), length=timedelta(hours=3),
+                host=user, added_by=user)
+        output = StringIO()
+        call_command('loadtest', user='tester', concurrency=3, requests=8,
+                     stdout=output)
+        output = output.getvalue()
+        self.assertIn(event.get_absolute_url(), output)
+        self.assertIn('8 requests in', output)
+        self.assertIn('Statuses: 200: ', output)
+
+
+class RecurrenceTestCase(LoggedInTestCase):
+    def setUp(self):
+        super().setUp()
+        self.series = events.Event.objects.create(
+                date=make_aware(datetime(2017, 3, 6, 18)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user,
+                recurrence='weekly')
+
+    def get_occurrences(self, start, end):
+        return events.Event.objects.occurrences(make_aware(start),
+                                                make_aware(end))
+
+    def test_weekly_keeps_local_time(self):
+        found = self.get_occurrences(datetime(2017, 3, 20),
+                                     datetime(2017, 4, 10))
+        self.assertEqual([event.date for event in found],
+                         [make_aware(datetime(2017, 3, 20, 18)),
+                          make_aware(datetime(2017, 3, 27, 18)),
+                          make_aware(datetime(2017, 4, 3, 18))])
+        self.assertTrue(all(event.pk == self.series.pk for event in found))
+
+    def test_count_and_until(self):
+        self.series.recurrence = 'biweekly'
+        self.series.recurrence_count = 3
+        self.series.save()
+        self.assertEqual(self.series.recurrence_end,
+                         make_aware(datetime(2017, 4, 3, 18)))
+        found = self.get_occurrences(datetime(2017, 1, 1),
+                                     datetime(2018, 1, 1))
+        self.assertEqual(len(found), 3)
+        self.series.recurrence_count = None
+        self.series.recurrence_until = make_aware(datetime(2017, 3, 21))
+        self.series.save()
+        found = self.get_occurrences(datetime(2017, 1, 1),
+                                     datetime(2018, 1, 1))
+        self.assertEqual(len(found), 2)
+        self.assertTrue(self.series.archived)
+
+    def test_monthly_falls_on_last_day_of_short_months(self):
+        self.series.date = make_aware(datetime(2017, 1, 31, 18))
+        self.series.recurrence = 'monthly'
+        self.series.save()
+        found = self.get_occurrences(datetime(2017, 2, 1),
+                                     datetime(2017, 5, 1))
+        self.assertEqual([event.date.day for event in found], [28, 31, 30])
+
+    def test_month_view_is_one_query(self):
+        url = reverse('calendar:month', args=(2030, 6))
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'has_event', count=5)
+
+    def test_exceptions(self):
+        events.Event.objects.create(
+                date=make_aware(datetime(2017, 3, 22, 20)),
+                length=timedelta(hours=3), host=self.user, added_by=self.user,
+                series=self.series,
+                original_date=make_aware(datetime(2017, 3, 20, 18)))
+        self.client.post(reverse('events:cancel-occurrence',
+                                 args=(self.series.pk, 2017, 3, 27)))
+        found = self.get_occurrences(datetime(2017, 3, 20),
+                                     datetime(2017, 4, 10))
+        self.assertEqual([event.date for event in found],
+                         [make_aware(datetime(2017, 3, 22, 20)),
+                          make_aware(datetime(2017, 4, 3, 18))])
+        response = self.client.get(reverse('calendar:day',
+                                           args=(2017, 3, 27)))
+        self.assertContains(response, "No events for that day!")
+        response = self.client.post(reverse(
+                'events:cancel-occurrence',
+                args=(self.series.pk, 2017, 3, 28)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cancel_form(self):
+        url = reverse('events:cancel-occurrence',
+                      args=(self.series.pk, 2017, 3, 27))
+        self.assertEqual(self.client.get(url).status_code, 405)
+        # The cached fragment must carry the token of each viewer
+        day_url = reverse('calendar:day', args=(2017, 3, 27))
+        self.client.get(day_url)
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.get(day_url)
+        self.assertNotContains(response, CalendarView.csrf_placeholder)
+        token = search(r"name='csrfmiddlewaretoken' value='(\w+)'",
+                       response.content.decode()).group(1)
+        self.assertEqual(client.post(url).status_code, 403)
+        response = client.post(url, {'csrfmiddlewaretoken': token})
+        self.assertRedirects(response, day_url)
+        self.assertTrue(self.series.exceptions.get().cancelled)
+
+    def test_feed_contains_rules(self):
+        self.client.post(reverse('events:cancel-occurrence',
+                                 args=(self.series.pk, 2017, 3, 27)))
+        response = self.client.get(reverse(
+                'feeds:all', args=(get_feed_token(self.user), )))
+        feed = b''.join(response.streaming_content).decode()
+        self.assertIn('RRULE:FREQ=WEEKLY;INTERVAL=1\r\n', feed)
+        self.assertIn('RECURRENCE-ID;TZID=Europe/Helsinki:20170327T180000\r\n',
+                      feed)
+        self.assertIn('STATUS:CANCELLED\r\n', feed)
+
+    def test_feed_keeps_local_time_across_dst_change(self):
+        response = self.client.get(reverse(
+                'feeds:all', args=(get_feed_token(self.user), )))
+        feed = b''.join(response.streaming_content).decode()
+        self.assertIn('DTSTART;TZID=Europe/Helsinki:20170306T180000\r\n',
+                      feed)
+        self.assertIn('BEGIN:VTIMEZONE\r\nTZID:Europe/Helsinki\r\n', feed)
+        self.assertIn('BEGIN:DAYLIGHT\r\nDTSTART:20170326T030000\r\n'
+                      'TZOFFSETFROM:+0200\r\nTZOFFSETTO:+0300\r\n', feed)
+        self.assertLess(feed.index('END:VTIMEZONE'),
+                        feed.index('BEGIN:VEVENT'))
+
+    def test_feed_in_zone_without_transitions(self):
+        with self.settings(TIME_ZONE='UTC'):
+            response = self.client.get(reverse(
+                    'feeds:all', args=(get_feed_token(self.user), )))
+            feed = b''.join(response.streaming_content).decode()
+        self.assertIn('BEGIN:VTIMEZONE\r\nTZID:UTC\r\n'
+                      'BEGIN:STANDARD\r\nDTSTART:20170306T160000\r\n'
+                      'TZOFFSETFROM:+0000\r\nTZOFFSETTO:+0000\r\n'
+                      'TZNAME:UTC\r\nEND:STANDARD\r\nEND:VTIMEZONE\r\n',
+                      feed)
+        self.assertIn('DTSTART;TZID=UTC:20170306T160000\r\n', feed)
+
+    def test_daylight_saving_time_changes(self):
+        self.series.date = make_aware(datetime(2030, 3, 3, 3, 30))
+        self.series.save()
+        for month in (3, 10):
+            response = self.client.get(reverse('calendar:month',
+                                               args=(2030, month)))
+            self.assertEqual(response.status_code, 200)
+        found = self.get_occurrences(datetime(2030, 3, 31),
+                                     datetime(2030, 4, 1))
+        self.assertEqual(localtime(found[0].date).hour, 4)
+        found = self.get_occurrences(datetime(2030, 10, 27),
+                                     datetime(2030, 10, 28))
+        self.assertEqual(found[0].date,
+                         make_aware(datetime(2030, 10, 27, 3, 30),
+                                    is_dst=False))
+
+
+class BenchmarkTestCase(TestCase):
+    """Checks query budgets of all views with synthetic data
+
+    Data is seeded at every scale listed in comma separated environment
+    variable GAMENIGHTPLANNER_BENCHMARK_SCALES, which defaults to 100 events.
+    When the variable is set, query counts and wall-clock percentiles of every
+    view are also written to stderr, for example:
+
+        GAMENIGHTPLANNER_BENCHMARK_SCALES=100,10000,100000 \\
+            python manage.py test gamenightplanner.tests.BenchmarkTestCase
+    """
+    SCALES = [int(scale) for scale in environ.get(
+        'GAMENIGHTPLANNER_BENCHMARK_SCALES', '100').split(',')]
+
+    REPORT = 'GAMENIGHTPLANNER_BENCHMARK_SCALES' in environ
+
+    ROUNDS = 10
+
+    # Maximum number of queries for each view, whatever the scale
+    QUERY_BUDGETS = {
+        'main': 4,
+        # Includes the end of the archive, which is cached once read
+        'calendar:index': 5,
+        'calendar:month': 4,
+        'calendar:week': 5,
+        'calendar:day': 5,
+        'events:show': 6,
+        'events:add': 2,
+        'events:add-on-week': 2,
+        'events:edit': 4,
+        'events:delete': 3,
+        'events:participate': 7,
+        'events:leave': 7,
+        'events:cancel-occurrence': 11,
+        'api:events': 4,
+        'api:best-times': 3,
+        'api:games': 3,
+        'api:users': 3,
+        'api:participation': 10,
+        'feeds:all': 6,
+        'feeds:personal': 6,
+        'account:availability': 3,
+        'account:reset-feeds': 6,
+        'account:login': 2,
+        'account:signup': 2,
+        'account:signup-form': 2,
+        'account:logout': 5,
+    }
+
+    def seed(self, scale):
+        random = Random(scale)
+        User.objects.bulk_create([User(username='user{}'.format(i))
+                                  for i in range(max(10, scale // 10))])
+        users = list(User.objects.values_list('pk', flat=True))
+        start = make_aware(datetime(2030, 6, 1, 18))
+        # Spread events over two years around the benchmarked dates
+        hours = 365 * 24
+        events.Event.objects.bulk_create([events.Event(
+                date=start + timedelta(hours=random.randrange(-hours, hours)),
+                length=timedelta(hours=random.randrange(1, 6)),
+                host_id=random.choice(users), added_by_id=random.choice(users))
+                for i in range(scale)])
+        participants, games = [], []
+        titles = events.GameTitle.objects.get_ids(
+                "Game {}".format(i) for i in range(4))
+        for pk in events.Event.objects.values_list('pk', flat=True):
+            for user in random.sample(users, random.randrange(0, 9)):
+                participants.append(events.Event.participants.through(
+                    event_id=pk, user_id=user))
+            for i in range(random.randrange(0, 4)):
+                name = "Game {}".format(i)
+                games.append(events.Game(event_id=pk, name=name,
+                                         title_id=titles[name.lower()]))
+        events.Event.participants.through.objects.bulk_create(participants)
+        events.Game.objects.bulk_create(games)
+        return events.Event.objects.filter(date__gte=start).first()
+
+    def get_requests(self, event, series):
+        """Returns (url name, args, method, data) of every request"""
+        date = event.date
+        year, week, weekday = date.isocalendar()
+        occurrence = series.date + timedelta(days=7)
+        token = get_feed_token(self.user)
+        week_range = {'start': date.date().isoformat(),
+                      'end': (date + timedelta(days=7)).isoformat()}
+        return [
+            ('main', (), 'get', {}),
+            ('calendar:index', (), 'get', {}),
+            ('calendar:month', (date.year, date.month), 'get', {}),
+            ('calendar:week', (year, week), 'get', {}),
+            ('calendar:day', (date.year, date.month, date.day), 'get', {}),
+            ('events:show', (event.pk, ), 'get', {}),
+            ('events:add', (date.year, date.month, date.day), 'get', {}),
+            ('events:add-on-week', (year, week), 'get', {}),
+            ('events:edit', (event.pk, ), 'get', {}),
+            ('events:delete', (event.pk, ), 'get', {}),
+            ('events:participate', (event.pk, ), 'get', {}),
+            ('events:leave', (event.pk, ), 'get', {}),
+            ('events:cancel-occurrence', (series.pk, occurrence.year,
+             occurrence.month, occurrence.day), 'post', {}),
+            ('api:events', (), 'get', {
+                'start': date.date().isoformat(),
+                'end': (date + timedelta(days=31)).isoformat()}),
+            ('api:best-times', (), 'get', week_range),
+            ('api:games', (), 'get', {'q': 'game'}),
+            ('api:users', (), 'get', {'q': 'user'}),
+            ('api:participation', (), 'post',
+             dict(week_range, action='join')),
+            ('feeds:all', (token, ), 'get', {}),
+            ('feeds:personal', (token, ), 'get', {}),
+            ('account:availability', (), 'get', {}),
+            ('account:reset-feeds', (), 'post', {}),
+            ('account:login', (), 'get', {}),
+            ('account:signup', (), 'get', {}),
+            ('account:signup-form', ('token', ), 'get', {}),
+            ('account:logout', (), 'get', {}),
+        ]
+
+    def request(self, name, args, method, data):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = perf_counter()
+            response = getattr(self.client, method)(
+                    reverse(name, args=args), data, follow=False)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = perf_counter() - started
+        self.assertLess(response.status_code, 400, name)
+        if name == 'account:logout':
+            self.client.force_login(self.user)
+        return len(queries), elapsed
+
+    def report(self, scale, results):
+        stderr.write('\n{} events\n'.format(scale))
+        stderr.write('{:<26}{:>8}{:>10}{:>10}{:>10}\n'.format(
+                'view', 'queries', 'p50 ms', 'p90 ms', 'p99 ms'))
+        for name, (count, times) in results.items():
+            times = sorted(times)
+            percentiles = [times[min(len(times) - 1, len(times) * p // 100)]
+                           * 1000 for p in (50, 90, 99)]
+            stderr.write('{:<26}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}\n'.format(
+                    name, count, *percentiles))
+
+    def run_scale(self, scale):
+        event = self.seed(scale)
+        self.user = User.objects.get(pk=event.host_id)
+        # Ends long before the event, so that it does not conflict with it
+        series = events.Event.objects.create(
+                date=event.date - timedelta(days=400),
+                length=timedelta(hours=3), host=self.user,
+                added_by=self.user, recurrence='weekly', recurrence_count=2)
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['account_verified_email'] = 'new@example.com'
+        session.save()
+        results = {}
+        for name, args, method, data in self.get_requests(event, series):
+            counts, times = [], []
+            for i in range(self.ROUNDS):
+                count, elapsed = self.request(name, args, method, data)
+                counts.append(count)
+                times.append(elapsed)
+            results[name] = max(counts), times
+            self.assertLessEqual(
+                    max(counts), self.QUERY_BUDGETS[name],
+                    "{} exceeds its query budget with {} events".format(
+                        name, scale))
+        self.assertEqual(set(results), set(self.QUERY_BUDGETS))
+        if self.REPORT:
+            self.report(scale, results)
+
+    def test_all_views_have_budgets(self):
+        def iter_names(patterns, prefix=''):
+            for pattern in patterns:
+                if not hasattr(pattern, 'url_patterns'):
+                    if pattern.name is not None:
+                        yield prefix + pattern.name
+                elif (isinstance(pattern.urlconf_name, list) and
+                      pattern.app_name is None):
+                    # Other apps are included from modules or as the admin
+                    yield from iter_names(
+                            pattern.url_patterns,
+                            prefix + (pattern.namespace or '') + ':')
+        self.assertEqual(set(iter_names(urls.urlpatterns)) -
+                         set(self.QUERY_BUDGETS), set())
+
+    def test_query_budgets(self):
+        for scale in self.SCALES:
+            with transaction.atomic():
+                self.run_scale(scale)
+                transaction.set_rollback(True)
+
+
+@override_settings(GAMENIGHTPLANNER_INSTRUMENTATION=True,
+                   MIDDLEWARE=settings.MIDDLEWARE + [
+                       'gamenightplanner.instrumentation.'
+                       'InstrumentationMiddleware'])
+class InstrumentationTestCase(LoggedInTestCase):
+    def test_server_timing_and_log(self):
+        url = reverse('calendar:month', args=(2017, 5))
+        with self.assertLogs('gamenightplanner.instrumentation') as logs:
+            response = self.client.get(url)
+        timings = [entry.split(';')[0]
+                   for entry in response['Server-Timing'].split(', ')]
+        # The cached fragment is rendered within the view
+        self.assertEqual(timings, ['sql', 'calendar', 'template', 'view',
+                                   'total'])
+        self.assertIn('desc="5 queries"', response['Server-Timing'])
+        line = loads(logs.records[0].getMessage())
+        self.assertEqual(line['url_name'], 'calendar:month')
+        self.assertEqual(line['sql_count'], 5)
+
+    def test_full_queries_log(self):
+        cache.clear()
+        queries_log = connection.queries_log
+        connection.queries_log = deque(maxlen=2)
+        try:
+            with self.assertLogs('gamenightplanner.instrumentation') as logs:
+                self.client.get(reverse('calendar:month', args=(2017, 5)))
+        finally:
+            connection.queries_log = queries_log
+        self.assertEqual(loads(logs.records[0].getMessage())['sql_count'], 5)
+
+    def test_disabled_without_setting(self):
+        with self.settings(GAMENIGHTPLANNER_INSTRUMENTATION=False):
+            response = self.client.get(reverse('calendar:month',
+                                               args=(2017, 5)))
+        self.assertFalse(response.has_header('Server-Timing'))
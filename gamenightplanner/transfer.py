@@ -0,0 +1,241 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Export and import of events
+
+Events are serialized one per line along with their games and participants,
+either as newline-delimited JSON or as CSV. Users are referred to by their
+usernames, but email addresses are accepted when importing as well.
+"""
+
+from csv import DictReader, DictWriter
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime, parse_duration
+from django.utils.duration import duration_string
+from json import dumps, loads
+from . import snapshots
+from .cache import invalidate_all
+from .models import archive, events
+
+FIELDS = ('id', 'date', 'length', 'host', 'added', 'added_by', 'recurrence',
+          'recurrence_count', 'recurrence_until', 'series', 'original_date',
+          'cancelled', 'games', 'participants')
+
+DATETIME_FIELDS = ('date', 'added', 'recurrence_until', 'original_date')
+
+INTEGER_FIELDS = ('id', 'recurrence_count', 'series')
+
+LIST_FIELDS = ('games', 'participants')
+
+FORMATS = ('ndjson', 'csv')
+
+
+def format_datetime(value):
+    return value.isoformat() if value is not None else None
+
+
+def export_rows(queryset):
+    """Iterates events of queryset as dictionaries of FIELDS"""
+    for event, games, participants in queryset.iter_with_related(
+            'date', 'length', 'host__username', 'added',
+            'added_by__username', 'recurrence', 'recurrence_count',
+            'recurrence_until', 'series_id', 'original_date', 'cancelled'):
+        yield {
+            'id': event['pk'],
+            'date': format_datetime(event['date']),
+            'length': (duration_string(event['length'])
+                       if event['length'] is not None else None),
+            'host': event['host__username'],
+            'added': format_datetime(event['added']),
+            'added_by': event['added_by__username'],
+            'recurrence': event['recurrence'],
+            'recurrence_count': event['recurrence_count'],
+            'recurrence_until': format_datetime(event['recurrence_until']),
+            'series': event['series_id'],
+            'original_date': format_datetime(event['original_date']),
+            'cancelled': event['cancelled'],
+            'games': games,
+            'participants': participants,
+        }
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield dumps(row) + '\n'
+
+
+def read_ndjson(lines):
+    for line in lines:
+        if line.strip():
+            yield loads(line)
+
+
+class Echo:
+    """File-like object that returns what is written to it"""
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Iterates CSV lines, lists are written one item per line in a cell"""
+    writer = DictWriter(Echo(), FIELDS)
+    yield writer.writerow(dict(zip(FIELDS, FIELDS)))
+    for row in rows:
+        row = dict(row)
+        for field in LIST_FIELDS:
+            row[field] = '\n'.join(row[field])
+        row['cancelled'] = int(row['cancelled'])
+        yield writer.writerow(row)
+
+
+def read_csv(lines):
+    for row in DictReader(lines):
+        row = {field: value if value != '' else None
+               for field, value in row.items()}
+        for field in INTEGER_FIELDS:
+            if row[field] is not None:
+                row[field] = int(row[field])
+        for field in LIST_FIELDS:
+            row[field] = row[field].split('\n') if row[field] else []
+        row['recurrence'] = row['recurrence'] or ''
+        row['cancelled'] = row['cancelled'] == '1'
+        yield row
+
+
+def iter_lines(rows, format):
+    return {'ndjson': iter_ndjson, 'csv': iter_csv}[format](rows)
+
+
+def read_lines(lines, format):
+    return {'ndjson': read_ndjson, 'csv': read_csv}[format](lines)
+
+
+def get_user_ids():
+    """Returns a map from usernames and lowercase emails to user ids"""
+    users = {}
+    emails = {}
+    for pk, username, email in User.objects.values_list(
+            'pk', 'username', 'email').iterator():
+        users[username] = pk
+        if email:
+            emails.setdefault(email.lower(), pk)
+    # Usernames take precedence over email addresses
+    emails.update(users)
+    return emails
+
+
+def advance_sequence(model, last_id):
+    """Makes the database assign ids after last_id to new rows of model
+
+    The sequence is never moved backwards, since the largest id in the table
+    may be smaller than ids already handed out, for example to events that
+    have been archived since. Only PostgreSQL needs this, SQLite and MySQL
+    continue from the largest id in the table.
+    """
+    connection = connections[model.objects.db]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, %s), "
+                "GREATEST(nextval(pg_get_serial_sequence(%s, %s)), %s))",
+                [model._meta.db_table, model._meta.pk.column] * 2 +
+                [last_id])
+
+
+def import_rows(rows, batch_size=1000):
+    """Creates events from rows in batches and returns their number
+
+    New events get ids following the largest existing id, including
+    archived ones, in the order of rows, so exceptions must come after their
+    series. Raises ValueError if a row refers to an unknown user or series.
+    """
+    user_ids = get_user_ids()
+    series_ids = {}
+    through = events.Event.participants.through
+
+    def get_user_id(value):
+        user_id = user_ids.get(value, user_ids.get((value or '').lower()))
+        if user_id is None:
+            raise ValueError("Unknown user {!r}".format(value))
+        return user_id
+
+    def create(batch, games, participants):
+        events.Event.objects.bulk_create(batch)
+        title_ids = events.GameTitle.objects.get_ids(
+                game.name for game in games)
+        for game in games:
+            game.title_id = title_ids[events.normalize_title(game.name)]
+        events.Game.objects.bulk_create(games)
+        through.objects.bulk_create(participants)
+
+    count = 0
+    with transaction.atomic():
+        # Archived events keep their ids, so new ids must follow them too
+        next_id = max(model.objects.aggregate(Max('pk'))['pk__max'] or 0
+                      for model in (events.Event,
+                                    archive.ArchivedEvent)) + 1
+        batch, games, participants = [], [], []
+        for row in rows:
+            event_id = next_id + count
+            series_id = None
+            if row['series'] is not None:
+                try:
+                    series_id = series_ids[row['series']]
+                except KeyError:
+                    raise ValueError("Series {} of event {} is not before "
+                                     "it".format(row['series'], row['id']))
+            user_set = {get_user_id(value) for value in row['participants']}
+            event = events.Event(
+                pk=event_id,
+                date=parse_datetime(row['date']),
+                length=(parse_duration(row['length'])
+                        if row['length'] is not None else None),
+                host_id=get_user_id(row['host']),
+                added=parse_datetime(row['added']),
+                added_by_id=get_user_id(row['added_by']),
+                recurrence=row['recurrence'],
+                recurrence_count=row['recurrence_count'],
+                recurrence_until=(parse_datetime(row['recurrence_until'])
+                                  if row['recurrence_until'] else None),
+                series_id=series_id,
+                original_date=(parse_datetime(row['original_date'])
+                               if row['original_date'] else None),
+                cancelled=row['cancelled'],
+                participant_count=len(user_set),
+                game_count=len(row['games']))
+            event.update_end_dates()
+            if event.recurrence:
+                series_ids[row['id']] = event_id
+            batch.append(event)
+            games.extend(events.Game(event_id=event_id, name=name)
+                         for name in row['games'])
+            participants.extend(through(event_id=event_id, user_id=user_id)
+                                for user_id in user_set)
+            count += 1
+            if len(batch) >= batch_size:
+                create(batch, games, participants)
+                batch, games, participants = [], [], []
+        create(batch, games, participants)
+        advance_sequence(events.Event, next_id + count - 1)
+    # Signals are not sent for bulk inserts
+    invalidate_all()
+    snapshots.remove_all()
+    return count
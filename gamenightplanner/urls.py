@@ -48,11 +48,28 @@ urlpatterns = [
             events.EventDetailView.add_participation_view, name='participate'),
         url(r'^leave/(?P<pk>\d+)/$',
             events.EventDetailView.remove_participation_view, name='leave'),
+        url(r'^cancel/(?P<pk>\d+)/(?P<year>\d+)/(?P<month>\d+)/' +
+            r'(?P<day>\d+)/$', events.EventDetailView.cancel_occurrence_view,
+            name='cancel-occurrence'),
         url(r'^edit/(?P<pk>\d+)/$', events.EventUpdateView.as_view(),
             name='edit'),
         url(r'^delete/(?P<pk>\d+)/$', events.EventDeleteView.as_view(),
             name='delete'),
     ], namespace='events')),
+    url(r'^api/', include([
+        url(r'^events/$', api.EventRangeView.as_view(), name='events'),
+        url(r'^best-times/$', api.BestTimeView.as_view(),
+            name='best-times'),
+        url(r'^games/$', api.GameTitleView.as_view(), name='games'),
+        url(r'^users/$', api.UserSearchView.as_view(), name='users'),
+        url(r'^participation/$', api.ParticipationView.as_view(),
+            name='participation'),
+    ], namespace='api')),
+    url(r'^feeds/(?P<token>[\w:-]+)/', include([
+        url(r'^events\.ics$', feeds.EventFeedView.as_view(), name='all'),
+        url(r'^my-events\.ics$', feeds.EventFeedView.as_view(personal=True),
+            name='personal'),
+    ], namespace='feeds')),
     url(r'^admin/', admin.site.urls),
     url(r'^account/', include([
         url(r'^login/$', account.LoginOptionsView.as_view(), name='login'),
@@ -60,6 +77,10 @@ urlpatterns = [
         url(r'^signup/$', account.SignupView.as_view(), name='signup'),
         url(r'^signup/(?P<token>\w+)/$', account.SignupFormView.as_view(),
             name='signup-form'),
+        url(r'^availability/$', account.AvailabilityView.as_view(),
+            name='availability'),
+        url(r'^reset-feeds/$', account.ResetFeedsView.as_view(),
+            name='reset-feeds'),
     ], namespace='account')),
     url(r'^auth/', include('social_django.urls', namespace='social')),
     url(r'^invitations/', include('invitations.urls',
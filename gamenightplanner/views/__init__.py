@@ -15,11 +15,15 @@
 # License along with Game Night Planner.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+from datetime import timedelta
+from django.urls import reverse
 from django.utils.timezone import now
+from django.views.decorators.http import condition
 from django.views.generic.base import TemplateResponseMixin, TemplateView
 from django.views.generic.edit import CreateView
+from ..cache import get_cached_feed_token, get_upcoming_events
 
-__all__ = ['account', 'calendar', 'events', 'MainView']
+__all__ = ['account', 'api', 'calendar', 'events', 'feeds', 'MainView']
 
 
 class AjaxableViewMixin(TemplateResponseMixin):
@@ -38,6 +42,30 @@ class AjaxableViewMixin(TemplateResponseMixin):
         return context
 
 
+class ConditionalViewMixin:
+    """Answers conditional GET requests without rendering anything
+
+    Subclasses return a quoted ETag from get_etag() and a datetime from
+    get_last_modified(), or None if they do not support either of them.
+    """
+    def get_etag(self):
+        return None
+
+    def get_last_modified(self):
+        return None
+
+    def get(self, request, *args, **kwargs):
+        def etag(request, *args, **kwargs):
+            return self.get_etag()
+
+        def last_modified(request, *args, **kwargs):
+            return self.get_last_modified()
+
+        view = condition(etag_func=etag,
+                         last_modified_func=last_modified)(super().get)
+        return view(request, *args, **kwargs)
+
+
 class CreateWithAddedInfoMixin(CreateView):
     def form_valid(self, form):
         form.instance.added_by = self.request.user
@@ -92,3 +120,19 @@ class CreateViewWithInlines(CreateView):
 
 class MainView(TemplateView):
     template_name = 'gamenightplanner/main.html'
+    upcoming_days = 60
+    upcoming_limit = 10
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.request.user.is_authenticated:
+            token = get_cached_feed_token(self.request.user)
+            context['feed_url'] = self.request.build_absolute_uri(
+                    reverse('feeds:all', args=(token, )))
+            context['personal_feed_url'] = self.request.build_absolute_uri(
+                    reverse('feeds:personal', args=(token, )))
+            start = now()
+            end = start + timedelta(days=self.upcoming_days)
+            context['upcoming_events'] = get_upcoming_events(
+                    self.request.user, start, end, self.upcoming_limit)
+        return context
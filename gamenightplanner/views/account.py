@@ -16,13 +16,18 @@
 # <http://www.gnu.org/licenses/>.
 
 from . import AjaxableViewMixin
-from ..account import send_user_signed_up
+from ..account import (get_user_by_email, reset_feed_key,
+                       send_user_signed_up)
+from ..models.availability import Availability
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
-from django.forms import ModelForm, ValidationError, EmailField
+from django.forms import (ModelForm, ValidationError, EmailField,
+                          modelformset_factory)
+from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.translation import ugettext as _
-from django.views.generic.base import TemplateView
-from django.views.generic.edit import CreateView
+from django.views.generic.base import TemplateView, View
+from django.views.generic.edit import CreateView, FormView
 from social_django.utils import load_strategy
 
 
@@ -39,8 +44,7 @@ class SignupForm(ModelForm):
 
     def clean_email(self):
         email = self.cleaned_data['email']
-        users = User.objects.filter(email=email)
-        if users.count() > 0:
+        if get_user_by_email(email) is not None:
             raise ValidationError(_("Email is already registered"))
         if email != self.initial['email']:
             raise ValidationError(_("Email must not be changed"))
@@ -52,16 +56,20 @@ class SignupFormView(AjaxableViewMixin, CreateView):
     form_class = SignupForm
 
     def dispatch(self, request, token, *args, **kwargs):
-        self.partial = load_strategy().partial_load(token)
+        self.token = token
         return super().dispatch(request, *args, **kwargs)
 
+    def get_partial(self):
+        """Returns the partial pipeline, which is needed only after signup"""
+        return load_strategy(self.request).partial_load(self.token)
+
     def get_initial(self):
         initial = super().get_initial()
         initial['email'] = self.request.session['account_verified_email']
         return initial
 
     def get_success_url(self):
-        return reverse('social:complete', args=(self.partial.backend,))
+        return reverse('social:complete', args=(self.get_partial().backend,))
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -69,5 +77,41 @@ class SignupFormView(AjaxableViewMixin, CreateView):
         return response
 
 
+AvailabilityFormSet = modelformset_factory(
+        Availability, fields=('weekday', 'start', 'end'), extra=2,
+        can_delete=True)
+
+
+class AvailabilityView(LoginRequiredMixin, AjaxableViewMixin, FormView):
+    """Edits weekly windows when the user is available"""
+    template_name = 'gamenightplanner/account/availability.html'
+    form_class = AvailabilityFormSet
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['queryset'] = self.request.user.availabilities.all()
+        return kwargs
+
+    def get_success_url(self):
+        return reverse('account:availability')
+
+    def form_valid(self, form):
+        for availability in form.save(commit=False):
+            availability.user = self.request.user
+            availability.save()
+        for availability in form.deleted_objects:
+            availability.delete()
+        return super().form_valid(form)
+
+
+class ResetFeedsView(LoginRequiredMixin, View):
+    """Revokes calendar feed urls of the user and redirects to main page"""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        reset_feed_key(request.user)
+        return redirect('main')
+
+
 class LoginOptionsView(AjaxableViewMixin, TemplateView):
     template_name = 'gamenightplanner/account/login.html'
@@ -0,0 +1,356 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from collections import defaultdict
+from datetime import timedelta
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import urlencode
+from django.utils.timezone import is_naive, now, utc
+from django.views.generic import View
+from json import dumps
+from ..cache import get_event_querysets
+from ..dates import aware_datetime, local_datetime, start_of_day
+from ..models import events
+from ..planning import find_best_times
+
+
+def parse_time(value):
+    """Parses date or datetime into aware datetime, returns None if invalid"""
+    if value is None:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            if is_naive(parsed):
+                parsed = aware_datetime(parsed)
+            return parsed
+        parsed = parse_date(value)
+    except ValueError:
+        # Well formatted but impossible, such as 2017-02-30
+        return None
+    if parsed is not None:
+        return start_of_day(parsed)
+    return None
+
+
+def parse_int(value, default=None, maximum=None):
+    """Parses non-negative integer, returns None if invalid"""
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    if value < 0 or maximum is not None and value > maximum:
+        return None
+    return value
+
+
+class EventRangeView(LoginRequiredMixin, View):
+    """Lists events and occurrences starting within [start, end) as JSON
+
+    Both start and end accept a date or a datetime. Series are expanded into
+    their occurrences, which share the id of the series. Results are returned
+    in pages of at most limit events and the url of the next page is given in
+    next.
+    """
+    raise_exception = True
+
+    default_limit = 100
+
+    max_limit = 500
+
+    def get_queryset(self, start, end, limit):
+        """Returns the first limit events and occurrences within [start, end)
+        """
+        querysets = get_event_querysets(start)
+        found = []
+        for queryset in querysets:
+            through = queryset.model.participants.through
+            participating = through.objects.filter(
+                    event=OuterRef('pk'), user=self.request.user.pk)
+            found += queryset.select_related('host').annotate(
+                    participating=Exists(participating)).occurrences(
+                    start, end, limit)
+        if len(querysets) > 1:
+            found.sort(key=lambda event: (event.date, event.pk))
+        return found[:limit]
+
+    def get_games(self, page):
+        ids = defaultdict(set)
+        for event in page:
+            ids[type(event)].add(event.pk)
+        games = defaultdict(list)
+        for model, pks in ids.items():
+            game_model = model._meta.get_field('games').related_model
+            for event_id, name in game_model.objects.filter(
+                    event_id__in=pks).order_by('pk').values_list('event_id',
+                                                                 'name'):
+                games[event_id].append(name)
+        return games
+
+    def serialize(self, event, games):
+        # Occurrences of series are in local time, stored events in UTC
+        starts = event.date.astimezone(utc)
+        if event.length is not None:
+            ends = starts + event.length
+        else:
+            ends = None
+        return dumps({
+            'id': event.pk,
+            'start': starts,
+            'end': ends,
+            'host': {'id': event.host_id, 'name': event.host.username},
+            'participants': event.participant_count,
+            'games': games.get(event.pk, []),
+            'participating': event.participating,
+        }, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+    def get_next_url(self, start, end, offset, limit):
+        return '{}?{}'.format(reverse('api:events'), urlencode({
+            'start': start.isoformat(), 'end': end.isoformat(),
+            'offset': offset + limit, 'limit': limit}))
+
+    def stream(self, page, next_url):
+        games = self.get_games(page)
+        yield '{"events":['
+        for i, event in enumerate(page):
+            if i > 0:
+                yield ','
+            yield self.serialize(event, games)
+        yield '],"next":{}}}'.format(dumps(next_url))
+
+    def get(self, request, *args, **kwargs):
+        start = parse_time(request.GET.get('start'))
+        end = parse_time(request.GET.get('end'))
+        offset = parse_int(request.GET.get('offset'), 0)
+        limit = parse_int(request.GET.get('limit'), self.default_limit,
+                          self.max_limit)
+        if start is None or end is None:
+            return JsonResponse({'error': "start and end are required"},
+                                status=400)
+        if offset is None or not limit:
+            return JsonResponse({'error': "invalid offset or limit"},
+                                status=400)
+        page = self.get_queryset(start, end, offset + limit + 1)[offset:]
+        if len(page) > limit:
+            page = page[:limit]
+            next_url = self.get_next_url(start, end, offset, limit)
+        else:
+            next_url = None
+        return StreamingHttpResponse(self.stream(page, next_url),
+                                     content_type='application/json')
+
+
+class UserSearchView(LoginRequiredMixin, View):
+    """Lists active users whose username starts with q as JSON
+
+    Usernames are matched case-sensitively, so that the unique index of
+    usernames serves the search. Results are returned in pages of at most
+    limit users and the url of the next page is given in next.
+    """
+    raise_exception = True
+
+    default_limit = 20
+
+    max_limit = 100
+
+    def get_next_url(self, prefix, offset, limit):
+        return '{}?{}'.format(reverse('api:users'), urlencode({
+            'q': prefix, 'offset': offset + limit, 'limit': limit}))
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.GET.get('q', '')
+        offset = parse_int(request.GET.get('offset'), 0)
+        limit = parse_int(request.GET.get('limit'), self.default_limit,
+                          self.max_limit)
+        if offset is None or not limit:
+            return JsonResponse({'error': "invalid offset or limit"},
+                                status=400)
+        page = list(User.objects.filter(
+                is_active=True, username__startswith=prefix).order_by(
+                'username').values_list('pk', 'username')[
+                offset:offset+limit+1])
+        next_url = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_url = self.get_next_url(prefix, offset, limit)
+        return JsonResponse({
+            'users': [{'id': pk, 'username': username}
+                      for pk, username in page],
+            'next': next_url})
+
+
+class BestTimeView(LoginRequiredMixin, View):
+    """Proposes start times within [start, end) that most users can attend
+
+    Times are computed from weekly availabilities of users, or only of the
+    users given with user. Length is given in minutes and proposals with
+    fewer than min users are left out. The url of every proposal opens the
+    event form with the time and the length filled in.
+    """
+    raise_exception = True
+
+    default_length = 3 * 60
+
+    default_limit = 5
+
+    max_limit = 20
+
+    max_days = 62
+
+    def serialize(self, proposal, usernames, length):
+        date = local_datetime(proposal.start)
+        url = reverse('events:add', kwargs={
+                'year': date.year, 'month': date.month, 'day': date.day,
+                'hour': date.hour, 'minute': date.minute})
+        return {
+            'start': proposal.start.astimezone(utc),
+            'end': proposal.end.astimezone(utc),
+            'users': [{'id': pk, 'name': usernames[pk]}
+                      for pk in proposal.users],
+            'url': '{}?{}'.format(url, urlencode({'length': length})),
+        }
+
+    def get(self, request, *args, **kwargs):
+        start = parse_time(request.GET.get('start'))
+        end = parse_time(request.GET.get('end'))
+        length = parse_int(request.GET.get('length'), self.default_length,
+                           24 * 60)
+        limit = parse_int(request.GET.get('limit'), self.default_limit,
+                          self.max_limit)
+        min_count = parse_int(request.GET.get('min'), 1)
+        users = request.GET.getlist('user') or None
+        if users is not None:
+            users = [parse_int(pk) for pk in users]
+        if start is None or end is None:
+            return JsonResponse({'error': "start and end are required"},
+                                status=400)
+        if end - start > timedelta(days=self.max_days):
+            return JsonResponse({'error': "range is too long"}, status=400)
+        if (not length or not limit or min_count is None or
+                users is not None and None in users):
+            return JsonResponse({'error': "invalid length, limit, min or "
+                                          "user"}, status=400)
+        proposals = find_best_times(start, end, timedelta(minutes=length),
+                                    limit, min_count, users)
+        usernames = dict(User.objects.filter(pk__in={
+                pk for proposal in proposals
+                for pk in proposal.users}).values_list('pk', 'username'))
+        return JsonResponse({'times': [
+                self.serialize(proposal, usernames, length)
+                for proposal in proposals]})
+
+
+class GameTitleView(LoginRequiredMixin, View):
+    """Lists names of game titles starting with q as JSON for autocompletion
+
+    Titles are matched by their normalized form, so case and spacing do not
+    matter, and the unique index of normalized titles serves the search.
+    """
+    raise_exception = True
+
+    default_limit = 10
+
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.GET.get('q', '')
+        limit = parse_int(request.GET.get('limit'), self.default_limit,
+                          self.max_limit)
+        if not limit:
+            return JsonResponse({'error': "invalid limit"}, status=400)
+        if not prefix.strip():
+            return JsonResponse({'titles': []})
+        titles = events.GameTitle.objects.search(prefix).values_list(
+                'name', flat=True)[:limit]
+        return JsonResponse({'titles': list(titles)})
+
+
+class ParticipationView(LoginRequiredMixin, View):
+    """Joins or leaves many events at once
+
+    Events are given either as event ids or as a range with start and end.
+    Archived events are skipped. Participations are changed in one
+    transaction, joining with a single bulk insert. After joining, pairs of
+    joined and other events of the user that overlap within the next
+    CONFLICT_DAYS are returned as conflicts.
+    """
+    raise_exception = True
+
+    actions = ('join', 'leave')
+
+    def get_queryset(self):
+        ids = self.request.POST.getlist('event')
+        start = parse_time(self.request.POST.get('start'))
+        end = parse_time(self.request.POST.get('end'))
+        queryset = events.Event.objects.upcoming()
+        if ids:
+            ids = [parse_int(pk) for pk in ids]
+            if None in ids:
+                return None
+            return queryset.filter(pk__in=ids)
+        if start is not None and end is not None:
+            # Exceptions moved away from the range are left out
+            return queryset.in_range(start, end).filter(
+                    ~Q(recurrence='') | Q(date__gte=start, date__lt=end))
+        return None
+
+    def get_conflicts(self, ids):
+        start = now()
+        end = start + timedelta(days=events.Event.CONFLICT_DAYS)
+        found = events.Event.objects.for_user(
+                self.request.user).overlapping(start, end)
+        joined = set(ids)
+        conflicts = set()
+        for first, second in events.iter_overlaps(found):
+            if ({first.pk, first.series_id} &
+                    {second.pk, second.series_id} - {None}):
+                continue  # Parts of the same series
+            if second.pk in joined and first.pk not in joined:
+                first, second = second, first
+            if first.pk in joined:
+                conflicts.add((first.pk, second.pk))
+        return sorted(list(pair) for pair in conflicts)
+
+    def post(self, request, *args, **kwargs):
+        action = request.POST.get('action')
+        if action not in self.actions:
+            return JsonResponse({'error': "action must be join or leave"},
+                                status=400)
+        queryset = self.get_queryset()
+        if queryset is None:
+            return JsonResponse({'error': "events or start and end are "
+                                          "required"}, status=400)
+        with transaction.atomic():
+            ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+            if action == 'join':
+                request.user.events.add(*ids)
+            else:
+                request.user.events.remove(*ids)
+        data = {'action': action, 'events': ids}
+        if action == 'join':
+            data['conflicts'] = self.get_conflicts(ids)
+        return JsonResponse(data)
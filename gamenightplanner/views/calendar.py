@@ -15,16 +15,26 @@
 # License along with Game Night Planner.  If not, see
 # <http://www.gnu.org/licenses/>.
 
-from . import AjaxableViewMixin
-from calendar import Calendar
-from datetime import date
+from . import AjaxableViewMixin, ConditionalViewMixin
+from collections import defaultdict
+from datetime import date, timedelta
+from hashlib import md5
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.urls import reverse
-from django.utils.timezone import now
-from django.utils.translation import ugettext as _
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.functional import SimpleLazyObject
+from django.utils.safestring import mark_safe
+from django.utils.timezone import get_current_timezone_name, now
+from django.utils.translation import get_language, ugettext as _
 from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
-from isoweek import Week
+from .. import layout, snapshots
+from ..cache import (day_period, get_cache, get_event_querysets,
+                     get_fragment_key, month_period, week_period)
+from ..dates import local_date, start_of_day
+from ..instrumentation import timing
 from ..models import events
 
 
@@ -40,34 +50,149 @@ class CalendarMixin(LoginRequiredMixin):
               _('December'))
 
     def month_link(self, year, month):
-        if month <= 0:
-            month = 12 - month
-            year -= 1
-        elif month >= 13:
-            month = month - 12
-            year += 1
-        return reverse('calendar:month', args=(year, month))
+        return layout.month_link(year, month)
 
     def week_link(self, week):
-        return reverse('calendar:week', args=(week.year, week.week))
+        return layout.week_link(week.year, week.week)
 
     def day_link(self, *args):
         if len(args) == 1:
-            date = args[0]
-            return reverse('calendar:day', args=(date.year, date.month,
-                                                 date.day))
+            return layout.day_link(args[0])
         if len(args) == 3:
-            year, month, day = args
-            return reverse('calendar:day', args=(year, month, day))
+            return layout.day_link(date(*args))
         raise TypeError("Expected 1 or 3 arguments")
 
+    def date_range(self, first_day, last_day):
+        """Returns half-open datetime range [start, end) that covers days from
+        first_day to last_day"""
+        return (start_of_day(first_day),
+                start_of_day(last_day + timedelta(days=1)))
 
-class CalendarView(AjaxableViewMixin, CalendarMixin, ListView):
+    def day_range(self, day):
+        return self.date_range(day, day)
+
+    def week_range(self, week):
+        return self.date_range(*layout.week_dates(week.year, week.week))
+
+    def month_range(self, year, month):
+        return self.date_range(*layout.month_dates(year, month))
+
+    def range_queryset(self, start, end):
+        """Returns events, series and exceptions affecting range [start, end)
+        """
+        return self.model.objects.in_range(start, end)
+
+    def get_occurrences(self, start, end, details=False):
+        """Returns events and occurrences within [start, end)
+
+        Archived events are read only if the range starts before the last
+        archived event ended, which can not be the case for future ranges.
+        """
+        querysets = get_event_querysets(start)
+        found = []
+        for queryset in querysets:
+            if details:
+                queryset = queryset.with_details()
+            found += queryset.occurrences(start, end)
+        if len(querysets) > 1:
+            found.sort(key=lambda event: (event.date, event.pk))
+        return found
+
+
+class CachedFragmentMixin:
+    """Caches the rendered fragment of a calendar period
+
+    The fragment is rendered without the surrounding base template, so that
+    it does not contain anything specific to the viewer other than the bits
+    returned by get_cache_vary(). CSRF tokens of forms are rendered as a
+    placeholder that is replaced with the token of the viewer when served.
+    """
+    cache_timeout = 24 * 60 * 60
+
+    csrf_placeholder = 'CSRF-TOKEN-OF-VIEWER'
+
+    def get_cache_period(self):
+        raise NotImplementedError
+
+    def get_cache_vary(self):
+        return (self.request.is_ajax(), get_language(),
+                get_current_timezone_name(), local_date(now()))
+
+    def render_fragment(self, context):
+        context = dict(context, csrf_token=self.csrf_placeholder)
+        with timing('template'):
+            return render_to_string(self.template_name, context,
+                                    self.request)
+
+    def get_fragment(self, context):
+        cache = get_cache()
+        key = get_fragment_key(self.get_cache_period(),
+                               *self.get_cache_vary())
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = self.render_fragment(context)
+            cache.set(key, fragment, self.cache_timeout)
+        return fragment
+
+    def render_to_response(self, context, **response_kwargs):
+        fragment = getattr(self, 'snapshot', None)
+        if fragment is None:
+            fragment = self.get_fragment(context)
+        if self.csrf_placeholder in fragment:
+            fragment = fragment.replace(self.csrf_placeholder,
+                                        get_token(self.request))
+        if self.request.is_ajax():
+            return HttpResponse(fragment, **response_kwargs)
+        context['fragment'] = mark_safe(fragment)
+        return super().render_to_response(context, **response_kwargs)
+
+
+class SnapshotMixin:
+    """Serves fragments of past periods from snapshots without queries"""
+    def get(self, request, *args, **kwargs):
+        self.snapshot = snapshots.read(request.path_info)
+        if self.snapshot is None:
+            return super().get(request, *args, **kwargs)
+        return self.render_to_response({'view': self})
+
+
+class ConditionalCalendarMixin(ConditionalViewMixin):
+    """Computes ETag from events in the visible range
+
+    Number of events changes when one is deleted or moved away from the range
+    and the newest modification time changes when one is added or edited, so
+    those are enough to notice changes with one cheap query. Last-Modified is
+    not sent, since deleting an event would not make it newer.
+    """
+    def get_visible_range(self):
+        raise NotImplementedError
+
+    def get_range_state(self):
+        if not hasattr(self, '_range_state'):
+            queryset = self.range_queryset(*self.get_visible_range())
+            self._range_state = queryset.order_by().aggregate(
+                    count=Count('pk'), updated=Max('updated'))
+        return self._range_state
+
+    def get_etag(self):
+        state = self.get_range_state()
+        parts = (state['count'], state['updated'], self.request.user.pk)
+        parts += self.get_cache_vary()
+        return '"{}"'.format(md5(repr(parts).encode()).hexdigest())
+
+
+class CalendarView(SnapshotMixin, ConditionalCalendarMixin,
+                   CachedFragmentMixin, AjaxableViewMixin, CalendarMixin,
+                   ListView):
     model = events.Event
 
     template_name = 'gamenightplanner/calendar/month.html'
 
     def dispatch(self, request, year=None, month=None, *args, **kwargs):
+        self.set_period(year, month)
+        return super().dispatch(request, *args, **kwargs)
+
+    def set_period(self, year=None, month=None):
         if year is not None and month is not None:
             self.year = int(year)
             self.month = int(month)
@@ -75,26 +200,40 @@ class CalendarView(AjaxableViewMixin, CalendarMixin, ListView):
             today = now()
             self.year = today.year
             self.month = today.month
-        return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        return self.model.objects.filter(date__year=self.year,
-                                         date__month=self.month)
+        return self.range_queryset(*self.month_range(self.year, self.month))
+
+    def get_cache_period(self):
+        return month_period(self.year, self.month)
+
+    def get_grid_days(self):
+        return layout.get_month(self.year, self.month).days
+
+    def get_visible_range(self):
+        days = self.get_grid_days()
+        return self.date_range(days[0], days[-1])
+
+    @timing('calendar')
+    def get_grid_events(self):
+        """Returns events of the visible grid grouped by local date"""
+        events = defaultdict(list)
+        for event in self.get_occurrences(*self.get_visible_range()):
+            events[local_date(event.date)].append(event)
+        return events
 
     def calendar_iter(self):
-        calendar = Calendar()
-        events = self.get_queryset()
-        today = date.today()
-        for i, d in enumerate(calendar.itermonthdates(self.year, self.month)):
-            classes = []
-            if i % 7 == 0:
-                week_n = d.isocalendar()[1]
-                week = []
-            if d == today:
-                classes.append('today')
-            week.append((d, events.filter(date__day=d.day), classes))
-            if i % 7 == 6:
-                yield week_n, week
+        """Yields (week, link, days) where days are (date, link, events,
+        classes) tuples"""
+        events = self.get_grid_events()
+        today = local_date(now())
+        for week in layout.get_month(self.year, self.month).weeks:
+            days = []
+            for day in week.days:
+                classes = ['today'] if day == today else []
+                days.append((day, layout.day_link(day), events.get(day, []),
+                             classes))
+            yield (week.week, layout.week_link(week.year, week.week), days)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -111,19 +250,30 @@ class CalendarView(AjaxableViewMixin, CalendarMixin, ListView):
         return context
 
 
-class WeekView(AjaxableViewMixin, CalendarMixin, ListView):
+class WeekView(SnapshotMixin, ConditionalCalendarMixin, CachedFragmentMixin,
+               AjaxableViewMixin, CalendarMixin, ListView):
     model = events.Event
     context_object_name = 'events'
 
     template_name = 'gamenightplanner/calendar/week.html'
 
     def dispatch(self, request, year, week, *args, **kwargs):
-        self.week = Week(int(year), int(week))
+        self.set_period(year, week)
         return super().dispatch(request, *args, **kwargs)
 
+    def set_period(self, year, week):
+        self.week = layout.get_week(int(year), int(week))
+
     def get_queryset(self):
-        return self.model.objects.filter(date__date__gte=self.week.monday(),
-                                         date__date__lte=self.week.sunday())
+        # Evaluated only if the fragment is not found from the cache
+        return SimpleLazyObject(lambda: self.get_occurrences(
+                *self.get_visible_range(), details=True))
+
+    def get_cache_period(self):
+        return week_period(self.week.year, self.week.week)
+
+    def get_visible_range(self):
+        return self.week_range(self.week)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -133,23 +283,37 @@ class WeekView(AjaxableViewMixin, CalendarMixin, ListView):
         context['daysofweeknames'] = self.DAYSOFWEEK
         context['daysofweekshort'] = self.DAYSOFWEEK_SHORT
         context['current_url'] = self.week_link(self.week)
-        context['next_url'] = self.week_link(self.week+1)
-        context['prev_url'] = self.week_link(self.week-1)
+        context['next_url'] = layout.week_link(self.week.year,
+                                               self.week.week+1)
+        context['prev_url'] = layout.week_link(self.week.year,
+                                               self.week.week-1)
         return context
 
 
-class DayView(AjaxableViewMixin, CalendarMixin, ListView):
+class DayView(SnapshotMixin, ConditionalCalendarMixin, CachedFragmentMixin,
+              AjaxableViewMixin, CalendarMixin, ListView):
     model = events.Event
     context_object_name = 'events'
 
     template_name = 'gamenightplanner/calendar/day.html'
 
     def dispatch(self, request, year, month, day, *args, **kwargs):
-        self.date = date(int(year), int(month), int(day))
+        self.set_period(year, month, day)
         return super().dispatch(request, *args, **kwargs)
 
+    def set_period(self, year, month, day):
+        self.date = date(int(year), int(month), int(day))
+
     def get_queryset(self):
-        return self.model.objects.filter(date__date=self.date)
+        # Evaluated only if the fragment is not found from the cache
+        return SimpleLazyObject(lambda: self.get_occurrences(
+                *self.get_visible_range(), details=True))
+
+    def get_cache_period(self):
+        return day_period(self.date)
+
+    def get_visible_range(self):
+        return self.day_range(self.date)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -161,8 +325,6 @@ class DayView(AjaxableViewMixin, CalendarMixin, ListView):
         context['dayofweekname'] = self.DAYSOFWEEK[self.date.weekday()]
         context['dayofweekshort'] = self.DAYSOFWEEK_SHORT[self.date.weekday()]
         context['current_url'] = self.day_link(self.date)
-        context['next_url'] = self.day_link(self.date.year, self.date.month,
-                                            self.date.day+1)
-        context['prev_url'] = self.day_link(self.date.year, self.date.month,
-                                            self.date.day-1)
+        context['next_url'] = self.day_link(self.date + timedelta(days=1))
+        context['prev_url'] = self.day_link(self.date - timedelta(days=1))
         return context
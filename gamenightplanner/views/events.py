@@ -15,27 +15,135 @@
 # License along with Game Night Planner.  If not, see
 # <http://www.gnu.org/licenses/>.
 
-from . import (AjaxableViewMixin, CreateWithAddedInfoMixin,
-               CreateViewWithInlines)
-from datetime import datetime, time
+from . import (AjaxableViewMixin, ConditionalViewMixin,
+               CreateWithAddedInfoMixin, CreateViewWithInlines)
+from copy import copy
+from datetime import date, datetime, time, timedelta
+from hashlib import md5
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
-from django.forms import ModelForm, ValidationError, inlineformset_factory
+from django.forms import (HiddenInput, ModelChoiceField, ModelForm,
+                          ValidationError, inlineformset_factory)
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.timezone import now
-from django.utils.translation import ugettext as _
+from django.utils.translation import get_language, ugettext as _
+from django.views.decorators.http import require_POST
 from django.views.generic import DetailView
 from django.views.generic.edit import UpdateView, DeleteView
-from isoweek import Week
-from ..models import events
+from .. import layout
+from ..dates import start_of_day
+from ..models import archive, events
 
 
-class CreateEventForm(ModelForm):
+class UserSearchInput(HiddenInput):
+    """Hidden user id with a username input that searches the user API
+
+    The value is either a User or an id, which is looked up to show its
+    username.
+    """
+    class Media:
+        js = ('js/user_search.js', )
+
+    # Shown with a label like any other field
+    is_hidden = False
+
+    def render(self, name, value, attrs=None, **kwargs):
+        attrs = dict(attrs or {})
+        attrs.setdefault('id', 'id_{}'.format(name))
+        if isinstance(value, User):
+            username = value.username
+            value = value.pk
+        elif value:
+            username = User.objects.filter(pk=value).values_list(
+                    'username', flat=True).first()
+        else:
+            username = None
+        return format_html(
+                '{}<input type="text" value="{}" list="{}_choices" '
+                'autocomplete="off" data-search-url="{}" data-target="{}" />'
+                '<datalist id="{}_choices"></datalist>',
+                super().render(name, value, attrs, **kwargs), username or '',
+                attrs['id'], reverse('api:users'), attrs['id'], attrs['id'])
+
+
+class UserField(ModelChoiceField):
+    """Chooses an active user by id without listing every user
+
+    Only the submitted id is looked up when the form is validated.
+    """
+    widget = UserSearchInput
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset.filter(is_active=True), **kwargs)
+
+    def prepare_value(self, value):
+        # The widget shows usernames of users it is given
+        if isinstance(value, User):
+            return value
+        return super().prepare_value(value)
+
+
+class UserFieldFormMixin:
+    """Shows the current host of the event by username"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.host_id is not None:
+            self.initial['host'] = self.instance.host
+
+
+class RecurrenceFormMixin:
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('recurrence'):
+            cleaned_data['recurrence_count'] = None
+            cleaned_data['recurrence_until'] = None
+        elif (cleaned_data.get('recurrence_count') is not None and
+                cleaned_data.get('recurrence_until') is not None):
+            raise ValidationError(_("give either number of occurrences or "
+                                    "end date, not both"))
+        return cleaned_data
+
+
+class ConflictFormMixin:
+    """Rejects events that overlap with other events of the host"""
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('date') is None or
+                cleaned_data.get('host') is None):
+            return cleaned_data
+        event = copy(self.instance)
+        for field in self._meta.fields:
+            if field in cleaned_data:
+                setattr(event, field, cleaned_data[field])
+        conflicts = event.get_conflicts(cleaned_data['host'])
+        if conflicts:
+            raise ValidationError(
+                    _("%(host)s has other events at the same time: "
+                      "%(events)s"),
+                    params={'host': cleaned_data['host'],
+                            'events': ", ".join(str(conflict.date)
+                                                for conflict in conflicts)})
+        return cleaned_data
+
+
+def conflicts_message(conflicts):
+    return _("This overlaps with your other events on %(dates)s.") % {
+            'dates': ", ".join(str(conflict.date) for conflict in conflicts)}
+
+
+class CreateEventForm(ConflictFormMixin, RecurrenceFormMixin,
+                      UserFieldFormMixin, ModelForm):
     class Meta:
         model = events.Event
-        fields = ['date', 'length', 'host']
+        fields = ['date', 'length', 'host', 'recurrence', 'recurrence_count',
+                  'recurrence_until']
+        field_classes = {'host': UserField}
 
     def clean_date(self):
         date = self.cleaned_data['date']
@@ -43,6 +151,16 @@ class CreateEventForm(ModelForm):
             raise ValidationError(_("date can not be in the past"))
         return date
 
+
+class EventUpdateForm(ConflictFormMixin, RecurrenceFormMixin,
+                      UserFieldFormMixin, ModelForm):
+    class Meta:
+        model = events.Event
+        fields = ['date', 'length', 'host', 'recurrence', 'recurrence_count',
+                  'recurrence_until']
+        field_classes = {'host': UserField}
+
+
 GameInlineFormSet = inlineformset_factory(events.Event, events.Game, extra=1,
                                           fields=('name',))
 
@@ -76,8 +194,8 @@ class CreateEventView(LoginRequiredMixin, AjaxableViewMixin,
                     self.previous = ('calendar:month', {'year': year,
                                                         'month': month})
             elif week is not None:
-                self.date = datetime.combine(Week(year, int(week)).monday(),
-                                             time(18, 0))
+                self.date = datetime.combine(
+                        layout.week_dates(year, int(week))[0], time(18, 0))
                 self.previous = ('calendar:week', {'year': year,
                                                    'week': week})
         return super().dispatch(request, *args, **kwargs)
@@ -86,6 +204,9 @@ class CreateEventView(LoginRequiredMixin, AjaxableViewMixin,
         initial = super().get_initial()
         if self.date is not None:
             initial['date'] = self.date
+        length = self.request.GET.get('length', '')
+        if length.isdigit():
+            initial['length'] = timedelta(minutes=int(length))
         initial['host'] = self.request.user
         return initial
 
@@ -103,17 +224,55 @@ class CreateEventView(LoginRequiredMixin, AjaxableViewMixin,
         return super().all_valid(form, **kwargs)
 
 
-class EventDetailView(LoginRequiredMixin, AjaxableViewMixin, DetailView):
+class EventDetailView(LoginRequiredMixin, ConditionalViewMixin,
+                      AjaxableViewMixin, DetailView):
     model = events.Event
+    context_object_name = 'event'
     template_name = 'gamenightplanner/event/event.html'
 
+    def get_modification_info(self):
+        if not hasattr(self, '_modification_info'):
+            fields = ('updated', 'date', 'recurrence', 'recurrence_end')
+            info = self.model.objects.filter(pk=self.kwargs['pk']).only(
+                    *fields).first()
+            if info is None:
+                info = archive.ArchivedEvent.objects.filter(
+                        pk=self.kwargs['pk']).only(*fields).first()
+            self._modification_info = info
+        return self._modification_info
+
+    def get_last_modified(self):
+        info = self.get_modification_info()
+        return info.updated if info is not None else None
+
+    def get_etag(self):
+        info = self.get_modification_info()
+        if info is None:
+            return None
+        parts = (info.updated, info.archived, self.request.user.pk,
+                 self.request.is_ajax(), get_language())
+        return '"{}"'.format(md5(repr(parts).encode()).hexdigest())
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('host').prefetch_related(
+                'games', 'participants')
+
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            return super().get_object(
+                    archive.ArchivedEvent.objects.select_related(
+                        'host').prefetch_related('games', 'participants'))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        obj = self.get_object()
+        obj = self.object
         context['can_edit'] = obj.has_change_permission(self.request, obj)
         context['can_delete'] = obj.has_delete_permission(self.request, obj)
-        context['participating'] = self.get_object().participants.filter(
-                pk=self.request.user.pk).exists()
+        context['participating'] = any(
+                participant.pk == self.request.user.pk
+                for participant in obj.participants.all())
         return context
 
     @staticmethod
@@ -123,6 +282,9 @@ class EventDetailView(LoginRequiredMixin, AjaxableViewMixin, DetailView):
         if event.archived:
             raise PermissionDenied
         event.participants.add(request.user)
+        conflicts = event.get_conflicts(request.user)
+        if conflicts:
+            messages.warning(request, conflicts_message(conflicts))
         return redirect('events:show', pk=pk)
 
     @staticmethod
@@ -134,11 +296,32 @@ class EventDetailView(LoginRequiredMixin, AjaxableViewMixin, DetailView):
         event.participants.remove(request.user)
         return redirect('events:show', pk=pk)
 
+    @staticmethod
+    @require_POST
+    @login_required
+    def cancel_occurrence_view(request, pk, year, month, day):
+        event = get_object_or_404(events.Event, pk=pk)
+        if (not event.recurrence or
+                not event.has_change_permission(request, event)):
+            raise PermissionDenied
+        day = date(int(year), int(month), int(day))
+        occurrences = list(event.occurrence_dates(
+                start_of_day(day), start_of_day(day + timedelta(days=1))))
+        if not occurrences:
+            raise Http404
+        events.Event.objects.update_or_create(
+                series=event, original_date=occurrences[0],
+                defaults={'date': occurrences[0], 'length': event.length,
+                          'host_id': event.host_id, 'cancelled': True,
+                          'added_by': request.user, 'added': now()})
+        return redirect('calendar:day', year=day.year, month=day.month,
+                        day=day.day)
+
 
 class EventUpdateView(LoginRequiredMixin, AjaxableViewMixin, UpdateView):
     model = events.Event
     template_name = 'gamenightplanner/event/edit.html'
-    fields = ('date', 'length', 'host')
+    form_class = EventUpdateForm
 
     def post(self, request, *args, **kwargs):
         if request.POST.get('cancel') is not None:
@@ -0,0 +1,300 @@
+# Copyright (c) 2017, Tomi Leppänen
+# This file is part of Game Night Planner
+#
+# Game Night Planner is free software: you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Game Night Planner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the Lesser
+# GNU General Public License for more details.
+#
+# You should have received a copy of the Lesser GNU General Public
+# License along with Game Night Planner.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from . import ConditionalViewMixin
+from datetime import datetime, timedelta
+from functools import lru_cache
+from hashlib import md5
+from django.db.models import Count, Max, Min
+from django.http import Http404, StreamingHttpResponse
+from django.utils.timezone import (get_current_timezone,
+                                   get_current_timezone_name, now, utc)
+from django.views.generic import View
+from ..account import get_feed_user
+from ..cache import get_event_querysets
+from ..dates import local_datetime
+from ..models import events
+
+ICAL_DATETIME_FORMAT = '%Y%m%dT%H%M%SZ'
+
+ICAL_LOCAL_DATETIME_FORMAT = '%Y%m%dT%H%M%S'
+
+TRANSITION_STEP = timedelta(days=7)
+
+TRANSITION_YEARS = 10
+
+
+def ical_escape(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def ical_line(name, value):
+    """Returns content line folded to lines of at most 75 octets"""
+    line = '{}:{}'.format(name, value).encode('utf-8')
+    parts = []
+    while len(line) > 75:
+        cut = 75 if not parts else 74
+        # Do not split multi-byte characters
+        while line[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(line[:cut])
+        line = line[cut:]
+    parts.append(line)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def ical_datetime(value):
+    return value.astimezone(utc).strftime(ICAL_DATETIME_FORMAT)
+
+
+def ical_local_datetime(value):
+    return local_datetime(value).strftime(ICAL_LOCAL_DATETIME_FORMAT)
+
+
+def ical_offset(value):
+    minutes = int(value.total_seconds()) // 60
+    return '{}{:02}{:02}'.format('-' if minutes < 0 else '+',
+                                 *divmod(abs(minutes), 60))
+
+
+def local_rule(timezone, moment):
+    """Returns (offset, dst, name) of timezone in effect at moment"""
+    local = moment.astimezone(timezone)
+    return local.utcoffset(), bool(local.dst()), local.tzname()
+
+
+def iter_transitions(timezone, since, until):
+    """Yields (start, offset from, offset to, dst, name) of time zone rules
+
+    Starts are aware UTC datetimes, beginning with the rule in effect at
+    since. Rules are compared a week apart until until, which no real time
+    zone changes back and forth within, and the exact start of a change is
+    searched to the second. Only the public tzinfo interface is used, so any
+    time zone works, including zones without transitions.
+    """
+    moment = since.astimezone(utc).replace(microsecond=0)
+    rule = local_rule(timezone, moment)
+    yield (moment, rule[0]) + rule
+    while moment < until:
+        following = min(moment + TRANSITION_STEP, until)
+        following_rule = local_rule(timezone, following)
+        if following_rule != rule:
+            low, high = 0, int((following - moment).total_seconds())
+            while high - low > 1:
+                middle = (low + high) // 2
+                if local_rule(timezone,
+                              moment + timedelta(seconds=middle)) == rule:
+                    low = middle
+                else:
+                    high = middle
+            yield ((moment + timedelta(seconds=high), rule[0]) +
+                   following_rule)
+            rule = following_rule
+        moment = following
+
+
+def ical_timezone(since):
+    """Returns VTIMEZONE of current time zone for times after since
+
+    Rules are listed for TRANSITION_YEARS from now, after which the last one
+    stays in effect.
+    """
+    until = datetime(max(since, now()).year + TRANSITION_YEARS, 1, 1,
+                     tzinfo=utc)
+    return format_timezone(get_current_timezone(),
+                           get_current_timezone_name(), since, until)
+
+
+@lru_cache(maxsize=64)
+def format_timezone(timezone, timezone_name, since, until):
+    """Returns VTIMEZONE of timezone for [since, until)
+
+    Searching rules takes thousands of offset lookups, so results are kept
+    between requests.
+    """
+    lines = [ical_line('BEGIN', 'VTIMEZONE'),
+             ical_line('TZID', timezone_name)]
+    for start, before, after, dst, name in iter_transitions(
+            timezone, since, until):
+        kind = 'DAYLIGHT' if dst else 'STANDARD'
+        lines += [
+            ical_line('BEGIN', kind),
+            ical_line('DTSTART', (start + before).strftime(
+                    ICAL_LOCAL_DATETIME_FORMAT)),
+            ical_line('TZOFFSETFROM', ical_offset(before)),
+            ical_line('TZOFFSETTO', ical_offset(after)),
+            ical_line('TZNAME', ical_escape(name)),
+            ical_line('END', kind),
+        ]
+    lines.append(ical_line('END', 'VTIMEZONE'))
+    return ''.join(lines)
+
+
+class FeedView(View):
+    """Streams an iCalendar feed of components from iter_components()"""
+    def get_title(self):
+        raise NotImplementedError
+
+    def iter_components(self):
+        raise NotImplementedError
+
+    def stream(self):
+        yield (ical_line('BEGIN', 'VCALENDAR') +
+               ical_line('VERSION', '2.0') +
+               ical_line('PRODID', '-//Game Night Planner//EN') +
+               ical_line('X-WR-CALNAME', ical_escape(self.get_title())))
+        yield from self.iter_components()
+        yield ical_line('END', 'VCALENDAR')
+
+    def get(self, request, *args, **kwargs):
+        response = StreamingHttpResponse(self.stream(),
+                                         content_type='text/calendar')
+        response['Content-Disposition'] = 'inline; filename="events.ics"'
+        return response
+
+
+class EventFeedView(ConditionalViewMixin, FeedView):
+    """Streams all events or events of the user as iCalendar feed
+
+    The user is identified by the token in the url, since calendar
+    applications can not log in. Events, games and participants are read with
+    three queries per table that are all ordered by event and merged while
+    writing, so memory use does not grow with the number of events. Archived
+    events are included. Only an ETag is sent, since deleting an event would
+    not make Last-Modified newer.
+    """
+    personal = False
+
+    def dispatch(self, request, token, *args, **kwargs):
+        self.user = get_feed_user(token)
+        if self.user is None:
+            raise Http404
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_title(self):
+        if self.personal:
+            return "Game nights of {}".format(self.user.username)
+        return "Game nights"
+
+    def get_querysets(self):
+        querysets = get_event_querysets()
+        if self.personal:
+            # Exceptions of joined series have no participants of their own
+            querysets = [queryset.for_user(self.user)
+                         for queryset in querysets]
+        return querysets
+
+    def get_feed_state(self):
+        if not hasattr(self, '_feed_state'):
+            states = [queryset.order_by().aggregate(
+                          count=Count('pk'), updated=Max('updated'),
+                          first=Min('date'))
+                      for queryset in self.get_querysets()]
+            updated = [state['updated'] for state in states
+                       if state['updated'] is not None]
+            first = [state['first'] for state in states
+                     if state['first'] is not None]
+            self._feed_state = {
+                'count': sum(state['count'] for state in states),
+                'updated': max(updated, default=None),
+                'first': min(first, default=None),
+            }
+        return self._feed_state
+
+    def get_etag(self):
+        state = self.get_feed_state()
+        parts = (state['count'], state['updated'], self.personal,
+                 self.user.pk)
+        return '"{}"'.format(md5(repr(parts).encode()).hexdigest())
+
+    def iter_events(self):
+        # Archived events are older, so they come first
+        for queryset in reversed(self.get_querysets()):
+            yield from queryset.iter_with_related(
+                    'date', 'length', 'updated', 'host__username',
+                    'recurrence', 'recurrence_count', 'recurrence_until',
+                    'series_id', 'original_date', 'cancelled')
+
+    @staticmethod
+    def format_rrule(event):
+        if event['recurrence'] == 'monthly':
+            day = local_datetime(event['date']).day
+            rule = 'FREQ=MONTHLY'
+            if day > 28:
+                # Occurrences fall on the last day of shorter months
+                rule += ';BYMONTHDAY={};BYSETPOS=-1'.format(
+                        ','.join(str(d) for d in range(28, day + 1)))
+        else:
+            rule = 'FREQ=WEEKLY;INTERVAL={}'.format(
+                    events.Event.RECURRENCE_DAYS[event['recurrence']] // 7)
+        if event['recurrence_count'] is not None:
+            rule += ';COUNT={}'.format(event['recurrence_count'])
+        elif event['recurrence_until'] is not None:
+            rule += ';UNTIL={}'.format(
+                    ical_datetime(event['recurrence_until']))
+        return rule
+
+    def format_event(self, event, games, participants):
+        url = self.request.build_absolute_uri(
+                events.Event(pk=event['pk']).get_absolute_url())
+        host = event['host__username']
+        if games:
+            summary = "{} hosted by {}".format(", ".join(games), host)
+        else:
+            summary = "Game night hosted by {}".format(host)
+        description = "Participants: {}\n{}".format(
+                ", ".join(participants) or "-", url)
+        uid = 'event-{}@{}'.format(event['series_id'] or event['pk'],
+                                   self.request.get_host())
+        # Local times keep occurrences of series at the same time of day
+        # across daylight saving time changes
+        timezone = get_current_timezone_name()
+        start = 'DTSTART;TZID={}'.format(timezone)
+        end = 'DTEND;TZID={}'.format(timezone)
+        lines = [
+            ical_line('BEGIN', 'VEVENT'),
+            ical_line('UID', uid),
+            ical_line('DTSTAMP', ical_datetime(event['updated'])),
+            ical_line(start, ical_local_datetime(event['date'])),
+        ]
+        if event['length'] is not None:
+            lines.append(ical_line(end, ical_local_datetime(
+                    event['date'] + event['length'])))
+        if event['recurrence']:
+            lines.append(ical_line('RRULE', self.format_rrule(event)))
+        if event['series_id'] is not None:
+            lines.append(ical_line(
+                    'RECURRENCE-ID;TZID={}'.format(timezone),
+                    ical_local_datetime(event['original_date'])))
+        if event['cancelled']:
+            lines.append(ical_line('STATUS', 'CANCELLED'))
+        lines += [
+            ical_line('SUMMARY', ical_escape(summary)),
+            ical_line('DESCRIPTION', ical_escape(description)),
+            ical_line('URL', url),
+            ical_line('END', 'VEVENT'),
+        ]
+        return ''.join(lines)
+
+    def iter_components(self):
+        first = self.get_feed_state()['first']
+        if first is not None:
+            yield ical_timezone(first)
+        for event, games, participants in self.iter_events():
+            yield self.format_event(event, games, participants)